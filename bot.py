@@ -1,15 +1,35 @@
-import win32gui
-import win32con
 import os
 from pathlib import Path
 import cv2
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 import numpy as np
-from PIL import Image
 from loguru import logger
 
-from grab_screen import grab_screen
-from autoitx_keys import mouse_move, click_left_mouse
+from capture import GdiCaptureBackend
+from template_cache import TemplateCache, ScaledTemplateCache
+from matcher import (
+    best_match,
+    best_match_in_roi,
+    crop_roi,
+    find_all_matches,
+    match_template,
+    scale_candidates,
+)
+from screen_classifier import ScreenClassifier
+from frame_watch import FrameChangeDetector
+from settings import (
+    SCREEN_SIGNATURES_FILE,
+    SCREEN_THRESHOLD,
+    IN_SCREEN_THRESHOLD,
+    CLICK_THRESHOLD,
+    MATCH_SCALE_RANGE,
+    MATCH_SCALE_STEP,
+)
+from input_backend import AutoItInputBackend
+from telemetry import Telemetry
+from window_tracker import WindowTracker
 
 
 class NoMatchingImageError(Exception):
@@ -24,6 +44,11 @@ class CanNotKeepGoingError(Exception):
     pass
 
 
+def _rect_size(rect):
+    left, top, right, bottom = rect
+    return right - left, bottom - top
+
+
 class NikkeBot:
     def __init__(
         self,
@@ -32,53 +57,230 @@ class NikkeBot:
         window_name,
         retry=5,
         debug_click_percent=False,
+        template_cache=None,
+        template_cache_bytes=64 * 1024 * 1024,
+        frame_max_age_ms=200,
+        pyramid_level=0,
+        retry_interval=0.2,
+        retry_max_interval=1.0,
+        capture_backend=None,
+        input_backend=None,
+        input_lock=None,
+        focus_before_input=False,
+        telemetry=None,
+        window_rect_max_age_ms=250,
+        scale_range=MATCH_SCALE_RANGE,
+        scale_step=MATCH_SCALE_STEP,
     ):
-        self.window = None
+        self.capture_backend = capture_backend or GdiCaptureBackend()
+        self.input_backend = input_backend or AutoItInputBackend()
+        # 多个任务同时运行时共用一个 input_lock, 每次点击前把自己的窗口切到前台
+        self.input_lock = input_lock or nullcontext()
+        self.focus_before_input = focus_before_input
+        self.input_wait_seconds = 0.0
+        # 没有传入时只在内存里累计, 不写文件
+        self.telemetry = telemetry or Telemetry()
         self.cwd = cwd
         self.window_name = window_name
+        # 缓存窗口句柄和位置, 位置变化时通知截图后端和 bot 自己
+        self.window_tracker = WindowTracker(
+            self.capture_backend, window_name, window_rect_max_age_ms
+        )
+        self.window_tracker.subscribe(self.capture_backend.on_window_rect_changed)
+        self.window_tracker.subscribe(self._on_window_rect_changed)
         self.retry = retry
+        # 重试间隔从 retry_interval 开始翻倍, 最多 retry_max_interval 秒
+        self.retry_interval = retry_interval
+        self.retry_max_interval = retry_max_interval
         self.debug_click_percent = debug_click_percent
+        # 可以传入共享的缓存, 多个 bot 共用同一份模板
+        self.template_cache = template_cache or TemplateCache(template_cache_bytes)
+        # frame() 作用域内共用同一张截图, 超过 frame_max_age_ms 才重新截图
+        self.frame_max_age_ms = frame_max_age_ms
+        self._frame_depth = 0
+        self._frame_max_age_ms = frame_max_age_ms
+        self._frame = None  # (captured_at, window_rect, screen, screen_gray)
+        self.screen_classifier = None
+        # 0 为原图匹配, 2 为先在 1/4 大小的图上粗匹配, 可以被每个操作单独指定
+        self.pyramid_level = pyramid_level
+        # 窗口大小和保存模板时不同时, 在 scale_range 内找能匹配上的缩放比例,
+        # scale_range 为 None 时不缩放
+        self.scaled_templates = ScaledTemplateCache(
+            scale_candidates(scale_range, scale_step)
+        )
+        self._preloaded_paths = []
 
     def set_retry(self, retry):
         self.retry = retry
 
+    def _retry_sleep(self, attempt, detector=None):
+        """
+        两次重试之间的等待, 传入 detector 时和失败时的画面比较, 一变化就提前结束等待
+
+        不管画面有没有变化, 等待结束后都会再真的匹配一次
+        """
+        if attempt >= self.retry - 1:
+            return  # 最后一次失败后不用再等
+        self.telemetry.add_retry()
+        interval = min(self.retry_interval * 2**attempt, self.retry_max_interval)
+        if detector is None:
+            time.sleep(interval)
+        else:
+            detector.reset()
+            detector.changed(self.get_game_screen_gray())
+            self.wait_for_change(interval, detector=detector)
+
     def set_debug_click_percent(self, debug_click_percent):
         self.debug_click_percent = debug_click_percent
 
     def get_window(self):
-        if not self.window:
-            self.window = win32gui.FindWindow(None, self.window_name)
-        return self.window
+        return self.window_tracker.get_hwnd()
 
     def set_foreground(self):
         hwnd = self.get_window()
         if hwnd:
-            if win32gui.IsIconic(hwnd):
-                win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
-            if hwnd != win32gui.GetForegroundWindow():
-                win32gui.SetForegroundWindow(hwnd)
+            self.capture_backend.set_foreground(hwnd)
         else:
             raise ValueError(f"未找到名为 '{self.window_name}' 的窗口")
 
     def get_window_rect(self):
-        hwnd = self.get_window()
-        if hwnd:
-            return win32gui.GetWindowRect(hwnd)
+        rect = self.window_tracker.get_rect()
+        if rect:
+            return rect
         else:
             raise ValueError(f"未找到名为 '{self.window_name}' 的窗口")
 
+    def _on_window_rect_changed(self, old_rect, new_rect):
+        # 之前的截图是按旧位置截的, 点击坐标会错
+        if old_rect is not None:
+            self.invalidate_frame()
+            if _rect_size(old_rect) != _rect_size(new_rect):
+                self.scaled_templates.clear_templates()
+
+    @contextmanager
+    def frame(self, max_age_ms=None):
+        """
+        在作用域内, 所有 get_game_screen 共用同一次截图
+
+        截图超过 max_age_ms (默认 frame_max_age_ms) 后会重新截图, 点击之后截图会失效
+        """
+        if self._frame_depth == 0:
+            self._frame_max_age_ms = (
+                self.frame_max_age_ms if max_age_ms is None else max_age_ms
+            )
+        self._frame_depth += 1
+        try:
+            yield self
+        finally:
+            self._frame_depth -= 1
+            if self._frame_depth == 0:
+                self._frame = None
+
+    def invalidate_frame(self):
+        self._frame = None
+
+    def _get_fresh_frame(self):
+        if self._frame_depth > 0 and self._frame is not None:
+            age_ms = (time.perf_counter() - self._frame[0]) * 1000
+            if age_ms <= self._frame_max_age_ms:
+                return self._frame
+        return None
+
+    def _store_frame(self, window_rect, screen, screen_gray):
+        if self._frame_depth > 0:
+            self._frame = (time.perf_counter(), window_rect, screen, screen_gray)
+
+    def get_frame_rect(self):
+        """当前帧截图时的窗口位置, 点击坐标要以它为准"""
+        if self._frame is not None:
+            return self._frame[1]
+        return self.get_window_rect()
+
     def get_game_screen(self):
+        """返回 BGRA 截图, 数组可能会在下次截图时被覆盖"""
+        frame = self._get_fresh_frame()
+        if frame and frame[2] is not None:
+            return frame[2]
+        window_rect = self.get_window_rect()
+        start = time.perf_counter()
+        screen = self.capture_backend.grab(window_rect)
+        self.telemetry.add_capture(time.perf_counter() - start)
+        self._store_frame(window_rect, screen, None)
+        return screen
+
+    def get_game_screen_gray(self):
+        """返回灰度截图, 所有匹配都用这个, 数组可能会在下次截图时被覆盖"""
+        frame = self._get_fresh_frame()
+        if frame:
+            if frame[3] is not None:
+                return frame[3]
+            screen_gray = cv2.cvtColor(frame[2], cv2.COLOR_BGRA2GRAY)
+            self._frame = (*frame[:3], screen_gray)
+            return screen_gray
         window_rect = self.get_window_rect()
-        return grab_screen(window_rect)
+        start = time.perf_counter()
+        screen_gray = self.capture_backend.grab_gray(window_rect)
+        self.telemetry.add_capture(time.perf_counter() - start)
+        self._store_frame(window_rect, None, screen_gray)
+        return screen_gray
 
-    def get_img(self, img_path):
+    def _get_cached_img(self, img_path):
         fullpath = Path(self.cwd).joinpath(img_path)
         if not os.path.exists(fullpath):
             raise FileNotFoundError(f"未找到图像 '{img_path}'")
-        pil_img = Image.open(fullpath)
-        return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        # 因为cv2不支持中文路径, 所以这里不用cv2.imread
-        # return cv2.imread(fullpath.as_posix(), cv2.IMREAD_COLOR)
+        return self.template_cache.get(fullpath)
+
+    def get_img(self, img_path):
+        """返回只读的 BGR 图像, 需要修改时请先 copy"""
+        return self._get_cached_img(img_path)[0]
+
+    def get_gray_img(self, img_path):
+        """返回只读的灰度图像"""
+        return self._get_cached_img(img_path)[1]
+
+    def template_cache_stats(self):
+        return self.template_cache.stats()
+
+    def preload_templates(self, img_paths, max_workers=4, on_progress=None):
+        """
+        在线程池中解码所有模板, 返回 {路径: 异常} 的失败列表
+
+        on_progress(完成数, 总数, 路径) 在每个模板完成时调用
+        """
+        img_paths = list(img_paths)
+        self._preloaded_paths = list(dict.fromkeys(self._preloaded_paths + img_paths))
+        failed = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._get_cached_img, path): path for path in img_paths
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[path] = e
+                if on_progress:
+                    on_progress(done, len(img_paths), path)
+
+        stats = self.template_cache.stats()
+        if stats["bytes"] >= stats["max_bytes"]:
+            logger.warning(
+                f"模板缓存已满 ({stats['bytes']} bytes), 部分模板运行时需要重新解码"
+            )
+        return failed
+
+    def warm_up(self, img_path=None):
+        """先跑一次匹配, 让 OpenCV 完成初始化, 不把这部分时间算进第一次点击"""
+        if img_path:
+            template = self.get_gray_img(img_path)
+        else:
+            template = np.zeros((16, 16), dtype="uint8")
+        h, w = template.shape[:2]
+        dummy_screen = np.zeros((h * 2, w * 2), dtype="uint8")
+        best_match(dummy_screen, template)
+        if self.pyramid_level > 0:
+            best_match(dummy_screen, template, self.pyramid_level)
 
     def _click_img(
         self,
@@ -88,52 +290,106 @@ class NikkeBot:
         job_name=None,
         click_times=1,
         match_type="in",
+        screen_roi=None,
+        click_roi=None,
+        pyramid_level=None,
+        screen_threshold=None,
+        click_threshold=None,
     ):
         if not job_name:
             job_name = img_path
 
-        is_scrren = False
+        with self.frame():
+            self._click_img_in_frame(
+                img_path,
+                screen=screen,
+                job_name=job_name,
+                click_times=click_times,
+                match_type=match_type,
+                screen_roi=screen_roi,
+                click_roi=click_roi,
+                pyramid_level=pyramid_level,
+                screen_threshold=screen_threshold,
+                click_threshold=click_threshold,
+            )
+
+    def _check_screen(
+        self, screen, match_type, roi=None, pyramid_level=None, threshold=None
+    ):
         if match_type == "in":
-            is_scrren = self.is_img_in_screen(screen)
+            return self.is_img_in_screen(
+                screen, threshold, roi=roi, pyramid_level=pyramid_level
+            )
         elif match_type == "is":
-            is_scrren = self.is_screen(screen)
+            return self.is_screen(
+                screen, threshold, roi=roi, pyramid_level=pyramid_level
+            )
         else:
             raise ValueError("match_type 参数错误")
-        if not is_scrren:
-            raise MaybeNeedWaitError()
 
-        game_screen = self.get_game_screen()
-        target_img = self.get_img(img_path)
+    def _click_img_in_frame(
+        self,
+        img_path,
+        *,
+        screen,
+        job_name,
+        click_times,
+        match_type,
+        screen_roi,
+        click_roi,
+        pyramid_level,
+        screen_threshold,
+        click_threshold,
+    ):
+        if not self._check_screen(
+            screen, match_type, screen_roi, pyramid_level, screen_threshold
+        ):
+            raise MaybeNeedWaitError()
 
-        game_screen_gray = cv2.cvtColor(game_screen, cv2.COLOR_BGR2GRAY)
-        target_img_gray = cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY)
-        result = cv2.matchTemplate(
-            game_screen_gray, target_img_gray, cv2.TM_CCOEFF_NORMED
+        game_screen_gray = self.get_game_screen_gray()
+        window_rect = self.get_frame_rect()
+        target_img_gray = self.get_gray_img(img_path)
+
+        threshold = CLICK_THRESHOLD if click_threshold is None else click_threshold
+        max_val, max_loc, target_img_gray = self._match(
+            game_screen_gray,
+            target_img_gray,
+            click_roi,
+            threshold,
+            pyramid_level,
+            img_path=img_path,
         )
-
-        threshold = 0.8
-        locations = np.where(result >= threshold)
-        if len(locations[0]) == 0:
+        if max_val < threshold:
             raise NoMatchingImageError()
 
-        window_rect = self.get_window_rect()
-        for point in zip(*locations[::-1]):
-            center_point_relative = (
-                point[0] + target_img.shape[1] // 2,
-                point[1] + target_img.shape[0] // 2,
-            )
-            window_left, window_top, windot_right, window_bottom = window_rect
-            center_point_absolute = (
-                center_point_relative[0] + window_left,
-                center_point_relative[1] + window_top,
-            )
-            mouse_move(center_point_absolute[0], center_point_absolute[1])
-            for _ in range(click_times):
-                click_left_mouse()
-                time.sleep(0.1)
-            break
+        center_point_relative = (
+            max_loc[0] + target_img_gray.shape[1] // 2,
+            max_loc[1] + target_img_gray.shape[0] // 2,
+        )
+        window_left, window_top, windot_right, window_bottom = window_rect
+        center_point_absolute = (
+            center_point_relative[0] + window_left,
+            center_point_relative[1] + window_top,
+        )
+        self.send_click(center_point_absolute[0], center_point_absolute[1], click_times)
         logger.debug(f"点击图像: {job_name} {click_times}次")
 
+    def send_click(self, x, y, click_times=1):
+        """
+        移动鼠标并点击, click_times 为 0 时只移动
+
+        多个任务同时运行时在 input_lock 上排队, 等待时间累计到 input_wait_seconds
+        """
+        start = time.perf_counter()
+        with self.input_lock:
+            self.input_wait_seconds += time.perf_counter() - start
+            if self.focus_before_input:
+                self.set_foreground()
+            self.input_backend.mouse_move(x, y)
+            if click_times > 0:
+                self.input_backend.click(click_times)
+        self.invalidate_frame()
+
     def _click_percent(
         self,
         x_percent,
@@ -143,84 +399,284 @@ class NikkeBot:
         job_name,
         click_times=1,
         match_type="is",
+        screen_roi=None,
+        pyramid_level=None,
+        screen_threshold=None,
+    ):
+        with self.frame():
+            self._click_percent_in_frame(
+                x_percent,
+                y_percent,
+                screen=screen,
+                job_name=job_name,
+                click_times=click_times,
+                match_type=match_type,
+                screen_roi=screen_roi,
+                pyramid_level=pyramid_level,
+                screen_threshold=screen_threshold,
+            )
+
+    def _click_percent_in_frame(
+        self,
+        x_percent,
+        y_percent,
+        *,
+        screen,
+        job_name,
+        click_times,
+        match_type,
+        screen_roi,
+        pyramid_level,
+        screen_threshold,
     ):
         if screen:
-            is_scrren = False
-            if match_type == "in":
-                is_scrren = self.is_img_in_screen(screen)
-            elif match_type == "is":
-                is_scrren = self.is_screen(screen)
-            else:
-                raise ValueError("match_type 参数错误")
-            if not is_scrren:
+            if not self._check_screen(
+                screen, match_type, screen_roi, pyramid_level, screen_threshold
+            ):
                 raise MaybeNeedWaitError()  # 未找到目标界面
 
-        window_rect = self.get_window_rect()
+        window_rect = self.get_frame_rect()
         window_left, window_top, windot_right, window_bottom = window_rect
         w = windot_right - window_left
         h = window_bottom - window_top
         x = int(window_left + w * x_percent)
         y = int(window_top + h * y_percent)
-        mouse_move(x, y)
         if self.debug_click_percent:
+            self.send_click(x, y, 0)
             logger.debug(f"跳过点击百分比: {job_name}")
             return
-        for _ in range(click_times):
-            click_left_mouse()
-            time.sleep(0.1)
+        self.send_click(x, y, click_times)
         logger.debug(f"点击百分比: {job_name} {click_times}次")
 
-    def is_screen(self, img_path):
-        """对整个页面进行匹配"""
-        game_screen = self.get_game_screen()
-        template_img = self.get_img(img_path)
+    def _get_pyramid_level(self, pyramid_level):
+        if pyramid_level is None:
+            return self.pyramid_level
+        return pyramid_level
 
-        game_screen_gray = cv2.cvtColor(game_screen, cv2.COLOR_BGR2GRAY)
-        template_img_gray = cv2.cvtColor(template_img, cv2.COLOR_BGR2GRAY)
-        result = cv2.matchTemplate(
-            game_screen_gray, template_img_gray, cv2.TM_CCOEFF_NORMED
+    def _match(
+        self, screen_gray, template_gray, roi, threshold, pyramid_level, img_path=None
+    ):
+        """
+        返回 (最高分, 左上角坐标, 实际使用的模板), 模板可能是缩放过的
+
+        这个窗口大小还没确定缩放比例时, 先用 1.0, 没匹配上才按离 1.0 由近到远尝试,
+        比例在 scaled_templates 里多次胜出后才会确定;
+        img_path 用于记录每个模板的匹配分数, 以及确定比例时区分不同的模板
+        """
+        start = time.perf_counter()
+        window_size = screen_gray.shape[:2]
+        pyramid_level = self._get_pyramid_level(pyramid_level)
+        best = None
+        for scale in self.scaled_templates.candidates(window_size):
+            template = self.scaled_templates.get(template_gray, scale)
+            # 找比例时其他比例先在缩小一半的图上粗匹配, 减少计算量
+            level = pyramid_level if scale == 1.0 else max(pyramid_level, 1)
+            max_val, max_loc = best_match_in_roi(
+                screen_gray, template, roi, threshold, level
+            )
+            if best is None or max_val > best[0]:
+                best = (max_val, max_loc, template, scale)
+            if max_val >= threshold:
+                break
+        max_val, max_loc, template, scale = best
+        self.telemetry.add_match(
+            time.perf_counter() - start, max_val, max_loc, img_path, threshold
         )
-
-        threshold = 0.8
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        if max_val >= threshold:
-            return True
-        else:
-            return False
-
-    def is_img_in_screen(self, img_path):
-        """找图像是否在页面中"""
-        game_screen = self.get_game_screen()
-        template_img = self.get_img(img_path)
-
-        game_screen_gray = cv2.cvtColor(game_screen, cv2.COLOR_BGR2GRAY)
-        template_img_gray = cv2.cvtColor(template_img, cv2.COLOR_BGR2GRAY)
-        result = cv2.matchTemplate(
-            game_screen_gray, template_img_gray, cv2.TM_CCOEFF_NORMED
+        self.window_tracker.report_match(max_val >= threshold)
+        old_scale, new_scale = self.scaled_templates.report(
+            window_size,
+            scale,
+            max_val >= threshold,
+            img_path or id(template_gray),
         )
+        if new_scale != old_scale:
+            if new_scale is None:
+                logger.debug(
+                    f"窗口大小 {window_size[::-1]} 的缩放比例 {old_scale} "
+                    "连续匹配失败, 重新查找"
+                )
+            else:
+                logger.debug(
+                    f"窗口大小 {window_size[::-1]} 使用模板缩放比例 {new_scale}"
+                )
+                self._prescale_templates(new_scale)
+        return max_val, max_loc, template
 
-        threshold = 0.9
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-        if max_val >= threshold:
-            return True
-        else:
-            return False
+    def _prescale_templates(self, scale):
+        """确定比例后把预加载的模板都缩放好, 之后的匹配不用再缩放"""
+        if scale == 1.0:
+            return
+        for img_path in self._preloaded_paths:
+            try:
+                self.scaled_templates.get(self.get_gray_img(img_path), scale)
+            except FileNotFoundError:
+                continue
+
+    def _get_scaled_gray_img(self, img_path, screen_gray):
+        """按当前窗口大小已经确定的比例缩放模板, 还没确定时返回原模板"""
+        template_gray = self.get_gray_img(img_path)
+        scale = self.scaled_templates.get_scale(screen_gray.shape[:2])
+        if scale is None:
+            return template_gray
+        return self.scaled_templates.get(template_gray, scale)
+
+    def is_screen(self, img_path, threshold=None, roi=None, pyramid_level=None):
+        """对整个页面进行匹配, threshold 为 None 时使用 SCREEN_THRESHOLD"""
+        if threshold is None:
+            threshold = SCREEN_THRESHOLD
+        game_screen_gray = self.get_game_screen_gray()
+        template_img_gray = self.get_gray_img(img_path)
+        max_val, _, _ = self._match(
+            game_screen_gray,
+            template_img_gray,
+            roi,
+            threshold,
+            pyramid_level,
+            img_path=img_path,
+        )
+        return max_val >= threshold
+
+    def is_img_in_screen(self, img_path, threshold=None, roi=None, pyramid_level=None):
+        """
+        找图像是否在页面中, roi 没找到时会对整个页面再找一次
+
+        threshold 为 None 时使用 IN_SCREEN_THRESHOLD
+        """
+        if threshold is None:
+            threshold = IN_SCREEN_THRESHOLD
+        game_screen_gray = self.get_game_screen_gray()
+        template_img_gray = self.get_gray_img(img_path)
+        max_val, _, _ = self._match(
+            game_screen_gray,
+            template_img_gray,
+            roi,
+            threshold,
+            pyramid_level,
+            img_path=img_path,
+        )
+        return max_val >= threshold
 
-    def wait_until_timeout(self, screen, max_wait_seconds=120):
-        start_time = time.time()
+    def wait_for_screen(
+        self,
+        screen,
+        timeout,
+        match_type="is",
+        roi=None,
+        pyramid_level=None,
+        min_interval=0.05,
+        max_interval=0.5,
+        backoff=1.5,
+        threshold=None,
+        force_match_interval=1.0,
+    ):
+        """
+        等待直到页面中出现 screen, 返回等待的秒数, 超时返回 None
+
+        画面没变化时不做模板匹配, 轮询间隔从 min_interval 开始按 backoff 倍增长,
+        画面一变化就重置为 min_interval;
+        变化检测漏掉时也不会一直等到超时, 每 force_match_interval 秒至少匹配一次;
+        roi 内没找到时会对整个页面再找, 所以比较的是整个画面
+        """
+        detector = FrameChangeDetector()
+        start_time = time.perf_counter()
+        interval = min_interval
+        match_count = 0
+        last_match_time = start_time
         while True:
-            if self.is_screen(screen):
-                logger.debug(f"等待加载完成: {screen}")
+            with self.frame():
+                changed = detector.changed(self.get_game_screen_gray())
+                now = time.perf_counter()
+                if changed or now - last_match_time >= force_match_interval:
+                    match_count += 1
+                    last_match_time = now
+                    if changed:
+                        interval = min_interval
+                    if self._check_screen(
+                        screen, match_type, roi, pyramid_level, threshold
+                    ):
+                        elapsed = time.perf_counter() - start_time
+                        logger.debug(
+                            f"检测到页面: {screen} "
+                            f"({elapsed:.2f}秒, 匹配{match_count}次)"
+                        )
+                        return elapsed
+                else:
+                    self.telemetry.add_skipped_match()
+                if not changed:
+                    interval = min(interval * backoff, max_interval)
+            if time.perf_counter() - start_time > timeout:
+                return None
+            time.sleep(interval)
+
+    def wait_for_change(self, timeout, roi=None, poll_interval=0.05, detector=None):
+        """
+        等待画面 (或 roi 内) 出现变化, 返回等待的秒数, 超时返回 None
+
+        传入 detector 时和它记住的上一帧比较, 不会更新它记住的帧;
+        否则和调用时的画面比较
+        """
+        if detector is None:
+            detector = FrameChangeDetector(roi=roi)
+            self.invalidate_frame()
+            detector.changed(self.get_game_screen_gray())
+        start_time = time.perf_counter()
+        while True:
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= timeout:
+                return None
+            time.sleep(min(poll_interval, timeout - elapsed))
+            # 可能在 frame() 作用域内, 每次都要重新截图
+            self.invalidate_frame()
+            value, _ = detector.diff(self.get_game_screen_gray())
+            if detector.is_changed(value):
+                return time.perf_counter() - start_time
+
+    def wait_until_stable(
+        self, stable_seconds, timeout, poll_interval=0.05, min_pixels=24
+    ):
+        """
+        等待画面在 stable_seconds 内没有变化 (例如动画播放完), 返回等待的秒数
+
+        缩略图中变化的像素少于 min_pixels 个 (默认约 1%) 时算静止,
+        角色待机动画之类的小范围变化不会一直等下去; 超时也直接返回, 不报错
+        """
+        detector = FrameChangeDetector(min_pixels=min_pixels)
+        start_time = time.perf_counter()
+        stable_since = start_time
+        while True:
+            now = time.perf_counter()
+            if detector.changed(self.get_game_screen_gray()):
+                stable_since = now
+            elif now - stable_since >= stable_seconds:
                 break
-            else:
-                logger.debug(f"再等待5秒加载: {screen}")
-                time.sleep(5)
-            if time.time() - start_time > max_wait_seconds:
-                raise CanNotKeepGoingError(f"加载超时: {screen}")
+            if now - start_time > timeout:
+                break
+            time.sleep(poll_interval)
+        return time.perf_counter() - start_time
+
+    def wait_until_timeout(
+        self,
+        screen,
+        max_wait_seconds=120,
+        roi=None,
+        pyramid_level=None,
+        threshold=None,
+    ):
+        elapsed = self.wait_for_screen(
+            screen,
+            max_wait_seconds,
+            roi=roi,
+            pyramid_level=pyramid_level,
+            threshold=threshold,
+        )
+        if elapsed is None:
+            raise CanNotKeepGoingError(f"加载超时: {screen}")
+        logger.debug(f"等待加载完成: {screen} ({elapsed:.2f}秒)")
+        return elapsed
 
     def match_contour(self, img_path):
         # 暂时没啥用, 以后需要匹配轮廓的时候再说
-        target_game_notice_screen = self.get_img(img_path)
+        target_game_notice_screen = self.get_img(img_path).copy()
         gray_target_game_notice_screen = cv2.cvtColor(
             target_game_notice_screen, cv2.COLOR_BGR2GRAY
         )
@@ -254,8 +710,44 @@ class NikkeBot:
         job_name=None,
         click_times=1,
         match_type="in",
+        screen_roi=None,
+        click_roi=None,
+        pyramid_level=None,
+        screen_threshold=None,
+        click_threshold=None,
+    ):
+        # 重试之间会 sleep, 超过 frame_max_age_ms 的截图会自动重新截
+        with self.frame():
+            return self._click_img_with_retry(
+                img_path,
+                screen=screen,
+                job_name=job_name,
+                click_times=click_times,
+                match_type=match_type,
+                screen_roi=screen_roi,
+                click_roi=click_roi,
+                pyramid_level=pyramid_level,
+                screen_threshold=screen_threshold,
+                click_threshold=click_threshold,
+            )
+
+    def _click_img_with_retry(
+        self,
+        img_path,
+        *,
+        screen,
+        job_name,
+        click_times,
+        match_type,
+        screen_roi,
+        click_roi,
+        pyramid_level,
+        screen_threshold,
+        click_threshold,
     ):
-        for _ in range(self.retry):
+        # roi 内没找到时会对整个页面再找, 所以要比较整个画面
+        detector = FrameChangeDetector()
+        for attempt in range(self.retry):
             try:
                 self._click_img(
                     img_path,
@@ -263,20 +755,63 @@ class NikkeBot:
                     job_name=job_name,
                     click_times=click_times,
                     match_type=match_type,
+                    screen_roi=screen_roi,
+                    click_roi=click_roi,
+                    pyramid_level=pyramid_level,
+                    screen_threshold=screen_threshold,
+                    click_threshold=click_threshold,
                 )
                 return True
             except NoMatchingImageError:
                 logger.debug(f"未找到图像: {job_name}")
-                time.sleep(1)
+                self._retry_sleep(attempt, detector)
             except MaybeNeedWaitError:
                 logger.debug("尚未迁移到目标界面")
-                time.sleep(1)
+                self._retry_sleep(attempt, detector)
         raise CanNotKeepGoingError(f"无法执行操作: {job_name}")
 
     def click_percent_with_retry(
-        self, x_percent, y_percent, *, screen, job_name, click_times=1, match_type="is"
+        self,
+        x_percent,
+        y_percent,
+        *,
+        screen,
+        job_name,
+        click_times=1,
+        match_type="is",
+        screen_roi=None,
+        pyramid_level=None,
+        screen_threshold=None,
     ):
-        for _ in range(self.retry):
+        with self.frame():
+            return self._click_percent_with_retry(
+                x_percent,
+                y_percent,
+                screen=screen,
+                job_name=job_name,
+                click_times=click_times,
+                match_type=match_type,
+                screen_roi=screen_roi,
+                pyramid_level=pyramid_level,
+                screen_threshold=screen_threshold,
+            )
+
+    def _click_percent_with_retry(
+        self,
+        x_percent,
+        y_percent,
+        *,
+        screen,
+        job_name,
+        click_times,
+        match_type,
+        screen_roi,
+        pyramid_level,
+        screen_threshold,
+    ):
+        # 不需要检查页面时不会失败, 不用比较画面
+        detector = FrameChangeDetector() if screen else None
+        for attempt in range(self.retry):
             try:
                 self._click_percent(
                     x_percent,
@@ -285,55 +820,49 @@ class NikkeBot:
                     job_name=job_name,
                     click_times=click_times,
                     match_type=match_type,
+                    screen_roi=screen_roi,
+                    pyramid_level=pyramid_level,
+                    screen_threshold=screen_threshold,
                 )
                 return True
             except MaybeNeedWaitError:
                 logger.debug("尚未迁移到目标界面")
-                time.sleep(1)
+                self._retry_sleep(attempt, detector)
         raise CanNotKeepGoingError(f"无法执行操作: {job_name}")
 
+    def find_all(self, img_path, threshold=None, roi=None, iou_threshold=0.3):
+        """
+        找出页面中所有匹配的位置, 返回按分数从高到低排序的 MatchBox 列表
+
+        坐标相对于窗口左上角, threshold 为 None 时使用 CLICK_THRESHOLD
+        """
+        if threshold is None:
+            threshold = CLICK_THRESHOLD
+        game_screen_gray = self.get_game_screen_gray()
+        template_img_gray = self._get_scaled_gray_img(img_path, game_screen_gray)
+        offset_x, offset_y = 0, 0
+        if roi:
+            game_screen_gray, (offset_x, offset_y) = crop_roi(game_screen_gray, roi)
+        result = match_template(game_screen_gray, template_img_gray)
+        if result is None:
+            return []
+        boxes = find_all_matches(
+            result, template_img_gray.shape, threshold, iou_threshold
+        )
+        return [box._replace(x=box.x + offset_x, y=box.y + offset_y) for box in boxes]
+
     def match_multi_img(self, img_path):
-        game_screen = self.get_game_screen()
-        target_img = self.get_img(img_path)
-        result = cv2.matchTemplate(game_screen, target_img, cv2.TM_CCOEFF_NORMED)
-        threshold = 0.8
-        locations = np.where(result >= threshold)
-
-        match_points = []
-        for point in zip(*locations[::-1]):
-            match_points.append(point)
-
-        unique_match_points = []
-        for point in match_points:
-            is_unique = True
-            for unique_point in unique_match_points:
-                if all(
-                    np.linalg.norm(np.array(unique_point) - np.array(u)) < 10
-                    for u in unique_match_points
-                ):
-                    is_unique = False
-                    break
-            if is_unique:
-                unique_match_points.append(point)
+        """返回所有匹配的左上角坐标"""
+        return [(box.x, box.y) for box in self.find_all(img_path)]
+
+    def get_screen_classifier(self):
+        if not self.screen_classifier:
+            self.screen_classifier = ScreenClassifier.from_file(
+                self, Path(self.cwd).joinpath(SCREEN_SIGNATURES_FILE)
+            )
+        return self.screen_classifier
 
     def what_scrren_now(self):
-        if self.is_screen("login_notice.png"):
-            return "login_notice"
-        elif self.is_screen("wait_touch_to_start.png"):
-            return "wait_touch_to_start"
-        elif self.is_screen("game_main.png"):
-            return "game_main"
-        elif self.is_screen("game_defense_box.png"):
-            return "game_defense_box"
-        elif self.is_screen("defense_annihilate_box.png"):
-            return "defense_annihilate_box"
-        elif self.is_img_in_screen("game_notice_header.png"):
-            return "game_notice"
-        elif self.is_screen("game_ark_page.png"):
-            return "game_ark_page"
-        elif self.is_img_in_screen("mail_box_header.png"):
-            return "mail_box"
-        elif self.is_img_in_screen("tribe_tower_header.png"):
-            return "tribe_tower"
-        else:
-            return "unknown"
+        label, confidence = self.get_screen_classifier().classify()
+        logger.debug(f"当前页面: {label} ({confidence:.3f})")
+        return label
@@ -0,0 +1,213 @@
+import os
+import time
+from pathlib import Path
+
+import cv2
+
+from template_cache import decode_image
+
+FRAME_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+VIDEO_EXTS = (".mp4", ".avi", ".mkv", ".mov")
+
+
+class CaptureBackend:
+    """
+    窗口查找和截图的接口, 截图统一返回 BGRA 格式 (h, w, 4)
+
+    rect 和 win32gui.GetWindowRect 一样, 为 (left, top, right, bottom)
+    """
+
+    def find_window(self, window_name):
+        """找不到时返回 None"""
+        raise NotImplementedError
+
+    def get_window_rect(self, hwnd):
+        raise NotImplementedError
+
+    def is_window(self, hwnd):
+        """句柄是否还有效, 要足够便宜, 每次刷新窗口位置前都会调用"""
+        return True
+
+    def set_foreground(self, hwnd):
+        raise NotImplementedError
+
+    def grab(self, rect):
+        raise NotImplementedError
+
+    def grab_gray(self, rect):
+        """返回灰度截图 (h, w)"""
+        return cv2.cvtColor(self.grab(rect), cv2.COLOR_BGRA2GRAY)
+
+    def on_window_rect_changed(self, old_rect, new_rect):
+        """窗口位置变化时调用, 可以提前准备截图用的内存"""
+        pass
+
+    def close(self):
+        pass
+
+
+class GdiCaptureBackend(CaptureBackend):
+    """
+    用 win32 GDI 截取真实窗口
+
+    截图复用同一块内存, 返回的数组会在下次 grab 时被覆盖
+    """
+
+    def __init__(self):
+        # win32 只有 Windows 上有, 用到的时候再导入
+        import win32gui
+        import win32con
+        from grab_screen import ScreenGrabber
+
+        self._win32gui = win32gui
+        self._win32con = win32con
+        self._grabber = ScreenGrabber()
+
+    def find_window(self, window_name):
+        return self._win32gui.FindWindow(None, window_name) or None
+
+    def get_window_rect(self, hwnd):
+        return self._win32gui.GetWindowRect(hwnd)
+
+    def is_window(self, hwnd):
+        return bool(self._win32gui.IsWindow(hwnd))
+
+    def set_foreground(self, hwnd):
+        win32gui = self._win32gui
+        if win32gui.IsIconic(hwnd):
+            win32gui.ShowWindow(hwnd, self._win32con.SW_RESTORE)
+        if hwnd != win32gui.GetForegroundWindow():
+            win32gui.SetForegroundWindow(hwnd)
+
+    def grab(self, rect):
+        return self._grabber.grab(rect)
+
+    def grab_gray(self, rect):
+        return self._grabber.grab_gray(rect)
+
+    def on_window_rect_changed(self, old_rect, new_rect):
+        self._grabber.prepare(new_rect)
+
+    def close(self):
+        self._grabber.release()
+
+
+class ReplayCaptureBackend(CaptureBackend):
+    """
+    从录制好的截图目录或者视频文件读取画面, 用于测试和跑分
+
+    目录中的文件名为毫秒时间戳 (例如 1700000000123.png), 不是数字时使用文件修改时间
+    realtime 为 True 时按原始时间戳回放, 否则每次 grab 读取下一帧
+    """
+
+    REPLAY_HWND = 1
+
+    def __init__(self, source, *, realtime=True, loop=False):
+        self.source = Path(source)
+        self.realtime = realtime
+        self.loop = loop
+        self._video = None
+        if self.source.is_dir():
+            self._frames = self._load_frame_index(self.source)
+        elif self.source.suffix.lower() in VIDEO_EXTS:
+            self._video = cv2.VideoCapture(os.fspath(self.source))
+            if not self._video.isOpened():
+                raise FileNotFoundError(f"无法打开视频 '{source}'")
+            self._frames = None
+        else:
+            raise ValueError(f"不支持的回放源 '{source}'")
+
+        self._index = 0
+        self._started_at = None
+        first = self._read_next()
+        if first is None:
+            raise FileNotFoundError(f"回放源中没有画面 '{source}'")
+        self._first_ts, self._current = first
+        self._pending = self._read_next()
+
+    @staticmethod
+    def _load_frame_index(directory):
+        frames = []
+        for path in directory.iterdir():
+            if path.suffix.lower() not in FRAME_EXTS:
+                continue
+            try:
+                ts = float(path.stem) / 1000
+            except ValueError:
+                ts = path.stat().st_mtime
+            frames.append((ts, path))
+        if not frames:
+            raise FileNotFoundError(f"目录中没有截图 '{directory}'")
+        frames.sort()
+        return frames
+
+    def _read_next(self):
+        """返回 (时间戳秒, BGRA), 读完时返回 None"""
+        if self._video is not None:
+            ok, bgr = self._video.read()
+            if not ok:
+                return None
+            ts = self._video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        else:
+            if self._index >= len(self._frames):
+                return None
+            ts, path = self._frames[self._index]
+            self._index += 1
+            bgr, _ = decode_image(path)
+        return ts, cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA)
+
+    def _rewind(self):
+        self._index = 0
+        if self._video is not None:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self._first_ts, self._current = self._read_next()
+        self._pending = self._read_next()
+        self._started_at = time.perf_counter()
+
+    def find_window(self, window_name):
+        return self.REPLAY_HWND
+
+    def get_window_rect(self, hwnd):
+        h, w = self._current.shape[:2]
+        return (0, 0, w - 1, h - 1)
+
+    def set_foreground(self, hwnd):
+        pass
+
+    def grab(self, rect):
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+            return self._current
+
+        if not self.realtime:
+            if self._pending is None and self.loop:
+                self._rewind()
+            elif self._pending is not None:
+                self._current = self._pending[1]
+                self._pending = self._read_next()
+            return self._current
+
+        # 跳到时间戳不超过回放时间的最后一帧
+        target_ts = self._first_ts + time.perf_counter() - self._started_at
+        while self._pending is not None and self._pending[0] <= target_ts:
+            self._current = self._pending[1]
+            self._pending = self._read_next()
+        if self._pending is None and self.loop:
+            self._rewind()
+        return self._current
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+
+def make_capture_backend(spec=None):
+    """
+    根据字符串创建截图后端: "gdi", "replay:<目录或视频>"
+    """
+    if not spec or spec == "gdi":
+        return GdiCaptureBackend()
+    if spec.startswith("replay:"):
+        return ReplayCaptureBackend(spec[len("replay:") :])
+    raise ValueError(f"未知的截图后端 '{spec}'")
@@ -0,0 +1,95 @@
+import json
+
+from .models import db, Job, Task, Operation
+
+# 导入时按这个顺序, 保证外键指向的行已经存在
+DUMP_MODELS = {"job": Job, "task": Task, "operation": Operation}
+
+
+def iter_dump_rows():
+    """逐行读出所有数据, 不会把整张表读进内存"""
+    for name, model in DUMP_MODELS.items():
+        query = model.select().order_by(model.id).dicts()
+        for row in query.iterator():
+            yield name, row
+
+
+def dump_ndjson(f):
+    """每行写一个 {"model": ..., "data": {...}}, 返回 {模型: 行数}"""
+    counts = dict.fromkeys(DUMP_MODELS, 0)
+    # 在同一个读事务里导出, 导出期间的修改不会混进来
+    with db.atomic():
+        for name, row in iter_dump_rows():
+            f.write(json.dumps({"model": name, "data": row}, ensure_ascii=False))
+            f.write("\n")
+            counts[name] += 1
+    return counts
+
+
+def iter_ndjson_rows(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            item = json.loads(line)
+            yield item["model"], item["data"]
+
+
+def iter_legacy_rows(data):
+    """旧版本 dumpdb 导出的嵌套 json: [{..., "tasks": [{..., "operations": [...]}]}]"""
+    tasks = []
+    for job_data in data:
+        tasks.extend(job_data.get("tasks", []))
+        yield "job", {k: v for k, v in job_data.items() if k != "tasks"}
+    operations = []
+    for task_data in tasks:
+        operations.extend(task_data.get("operations", []))
+        yield "task", {k: v for k, v in task_data.items() if k != "operations"}
+    for ope_data in operations:
+        yield "operation", ope_data
+
+
+def _insert_statement(model):
+    fields = list(model._meta.sorted_fields)
+    columns = ", ".join(f'"{field.column_name}"' for field in fields)
+    placeholders = ", ".join("?" for _ in fields)
+    sql = f'INSERT INTO "{model._meta.table_name}" ({columns}) VALUES ({placeholders})'
+    return fields, sql
+
+
+def load_rows(rows, batch_size=1000):
+    """
+    分批插入, 全部在一个事务里, 返回 {模型: 行数}
+
+    每批用同一条预编译的 INSERT 执行 executemany, 不在 python 里为每行拼 SQL;
+    rows 需要按 job, task, operation 的顺序, 不认识的字段会被忽略, 缺少的字段使用默认值
+    """
+    statements = {name: _insert_statement(model) for name, model in DUMP_MODELS.items()}
+    counts = dict.fromkeys(DUMP_MODELS, 0)
+    batch = []
+    batch_model = None
+
+    def flush():
+        if batch:
+            db.cursor().executemany(statements[batch_model][1], batch)
+            counts[batch_model] += len(batch)
+            batch.clear()
+
+    with db.atomic():
+        for name, data in rows:
+            if name != batch_model or len(batch) >= batch_size:
+                flush()
+                batch_model = name
+            batch.append(tuple(_row_values(statements[name][0], data)))
+        flush()
+    return counts
+
+
+def _row_values(fields, data):
+    for field in fields:
+        if field.name in data:
+            value = data[field.name]
+        elif field.default is not None:
+            value = field.default() if callable(field.default) else field.default
+        else:
+            value = None
+        yield field.db_value(value)
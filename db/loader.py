@@ -0,0 +1,39 @@
+from peewee import prefetch
+
+from .models import Job, Task, Operation
+
+
+def _ordered_tasks():
+    return Task.select().order_by(Task.position, Task.id)
+
+
+def _ordered_operations():
+    return Operation.select().order_by(Operation.position, Operation.id)
+
+
+def load_job_tree(job_query=None):
+    """
+    三次查询读出 job, task 和 operation, 不会每个 job/task 再查一次
+
+    job.tasks 和 task.operations 是按 position 排好序的 list,
+    之后 len(job.tasks), job.get_orded_tasks() 等都不再访问数据库
+    """
+    if job_query is None:
+        job_query = Job.select()
+    return prefetch(job_query, _ordered_tasks(), _ordered_operations())
+
+
+def load_job(job_id):
+    """读出一个 job 和它的所有 task, operation, 不存在时抛出 Job.DoesNotExist"""
+    jobs = load_job_tree(Job.select().where(Job.id == job_id))
+    if not jobs:
+        raise Job.DoesNotExist(f"Job {job_id} not found")
+    return jobs[0]
+
+
+def load_task(task_id):
+    """读出一个 task 和它的所有 operation, 不存在时抛出 Task.DoesNotExist"""
+    tasks = prefetch(Task.select().where(Task.id == task_id), _ordered_operations())
+    if not tasks:
+        raise Task.DoesNotExist(f"Task {task_id} not found")
+    return tasks[0]
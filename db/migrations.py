@@ -0,0 +1,81 @@
+from loguru import logger
+from playhouse.migrate import SqliteMigrator, migrate
+
+from .ordering import POSITION_GAP
+from .utils import sort_model_by_order
+
+
+def add_missing_columns(db, models):
+    """
+    给已有的表补上模型里新增的字段
+
+    新增字段需要 null=True 或者有 default, 否则旧数据无法迁移
+    """
+    migrator = SqliteMigrator(db)
+    operations = []
+    for model in models:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue  # 新表由 create_tables 创建
+        columns = {col.name for col in db.get_columns(table)}
+        for field in model._meta.sorted_fields:
+            if field.column_name in columns:
+                continue
+            logger.info(f"Adding column {table}.{field.column_name}")
+            operations.append(migrator.add_column(table, field.column_name, field))
+    if operations:
+        with db.atomic():
+            migrate(*operations)
+
+
+def _assign_positions(model, parents, children_of, order_of):
+    updated = []
+    for parent in parents:
+        children = children_of(parent)
+        if all(child.position is not None for child in children):
+            continue
+        for i, child in enumerate(sort_model_by_order(children, order_of(parent)), 1):
+            child.position = i * POSITION_GAP
+            updated.append(child)
+    if updated:
+        model.bulk_update(updated, fields=[model.position], batch_size=500)
+    return len(updated)
+
+
+def migrate_order_arrays(db, job_model, task_model, operation_model):
+    """
+    把旧版本 Job.task_order / Task.operation_order 里的顺序写入 position
+
+    只处理还有 position 为空的 job/task, 已经迁移过的不会再动
+    """
+    tasks_missing = task_model.select().where(task_model.position.is_null()).exists()
+    operations_missing = (
+        operation_model.select().where(operation_model.position.is_null()).exists()
+    )
+    if not tasks_missing and not operations_missing:
+        return
+
+    tasks_by_job = {}
+    for task in task_model.select():
+        tasks_by_job.setdefault(task.job_id, []).append(task)
+    operations_by_task = {}
+    for operation in operation_model.select():
+        operations_by_task.setdefault(operation.task_id, []).append(operation)
+
+    with db.atomic():
+        task_count = _assign_positions(
+            task_model,
+            job_model.select(),
+            lambda job: tasks_by_job.get(job.id, []),
+            lambda job: job.task_order,
+        )
+        operation_count = _assign_positions(
+            operation_model,
+            task_model.select(),
+            lambda task: operations_by_task.get(task.id, []),
+            lambda task: task.operation_order,
+        )
+    logger.info(
+        f"Migrated order arrays to position: {task_count} tasks, "
+        f"{operation_count} operations"
+    )
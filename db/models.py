@@ -11,14 +11,31 @@ from peewee import (
 import json
 from enum import Enum
 
-from .utils import sort_model_by_order
+from .migrations import add_missing_columns, migrate_order_arrays
+from .ordering import next_position
 
-db = SqliteDatabase("db.sqlite3")
+# WAL 模式下读写不会互相阻塞, 界面编辑时后台任务也能读
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    # WAL 下 normal 只会在断电时丢失最后的事务, 不会损坏数据库
+    "synchronous": "normal",
+    "cache_size": -16 * 1024,  # 负数单位为 KiB, 即 16MB
+    "mmap_size": 64 * 1024 * 1024,
+}
+# 数据库被其他连接锁住时最多等待的秒数
+SQLITE_BUSY_TIMEOUT = 10
+
+# peewee 每个线程使用自己的连接, 工作线程第一次查询时自动连接并设置 pragmas,
+# 工作线程里最好用 db.connection_context() 包起来, 结束时关闭连接
+db = SqliteDatabase("db.sqlite3", pragmas=SQLITE_PRAGMAS, timeout=SQLITE_BUSY_TIMEOUT)
 
 
 def init_db():
-    db.connect()
+    db.connect(reuse_if_open=True)
+    # 先补上新增的字段, create_tables 才能给已有的表建索引
+    add_missing_columns(db, [Job, Task, Operation])
     db.create_tables([Job, Task, Operation])
+    migrate_order_arrays(db, Job, Task, Operation)
 
 
 class JSONField(TextField):
@@ -56,6 +73,7 @@ class OperationType(Enum):
 class Job(Model):
     name = CharField()
     window_name = CharField()
+    # 旧版本保存顺序的 id 数组, 现在用 Task.position 排序, 只在迁移旧数据时读取
     task_order = JSONField(default=list())
 
     class Meta:
@@ -63,7 +81,10 @@ class Job(Model):
         table_name = "jobs"
 
     def get_orded_tasks(self):
-        return sort_model_by_order(self.tasks, self.task_order)
+        # load_job_tree 读出的 tasks 已经是排好序的 list
+        if isinstance(self.tasks, list):
+            return self.tasks
+        return list(self.tasks.order_by(Task.position, Task.id))
 
 
 class Task(Model):
@@ -75,14 +96,32 @@ class Task(Model):
     ignore_error = BooleanField(default=False)
     skip_this = BooleanField(default=False)
     job = ForeignKeyField(Job, backref="tasks", on_delete="CASCADE")
+    # 旧版本保存顺序的 id 数组, 现在用 Operation.position 排序, 只在迁移旧数据时读取
     operation_order = JSONField(default=list())
+    # 在 job 中的顺序, 从小到大, 拖拽时取两边的平均值, 只更新被移动的一行
+    position = FloatField(null=True)
+    # 操作之间的等待, 单位秒, operation 上没有设置时使用 task 上的值
+    min_delay = FloatField(null=True)
+    max_delay = FloatField(null=True)
 
     class Meta:
         database = db
         table_name = "tasks"
+        indexes = ((("job", "position"), False),)
+
+    def save(self, *args, **kwargs):
+        # 新建的 task 放到最后
+        if self.position is None:
+            self.position = next_position(
+                Task.select().where(Task.job == self.job_id), Task.position
+            )
+        return super().save(*args, **kwargs)
 
     def get_orded_operations(self):
-        return sort_model_by_order(self.operations, self.operation_order)
+        # load_job_tree 读出的 operations 已经是排好序的 list
+        if isinstance(self.operations, list):
+            return self.operations
+        return list(self.operations.order_by(Operation.position, Operation.id))
 
 
 class Operation(Model):
@@ -109,8 +148,36 @@ class Operation(Model):
     wait_timeout = IntegerField(null=True)  # 单位秒
     # 当是隐式等待时, 会等完 wait_timeout 秒
     is_implicity_wait = BooleanField(default=False)
+    # 匹配区域, 为窗口的比例 [x, y, w, h], 取值 0~1, 为 None 时匹配整个页面
+    # screen_roi 用于判断页面的图像 (screen_img 或 click_percent_match_img)
+    # 区域内没找到时会再对整个页面匹配一次
+    screen_roi = JSONField(null=True)
+    click_roi = JSONField(null=True)
+    # 金字塔匹配层数, 0 为原图匹配, 2 为先在 1/4 大小的图上粗匹配再精确匹配
+    pyramid_level = IntegerField(default=0)
+    # 开始这个操作前至少等待 min_delay 秒, 之后检测到目标页面就立刻执行,
+    # 最多等待 max_delay 秒, 为 None 时使用 task 上的值
+    min_delay = FloatField(null=True)
+    max_delay = FloatField(null=True)
+    # 匹配阈值, 为 None 时使用 settings 里的默认值
+    # screen_threshold 用于 screen_img 或 click_percent_match_img, click_threshold 用于 click_img
+    # 可以用 mng.py tunethresholds 根据 telemetry 里记录的分数自动计算
+    screen_threshold = FloatField(null=True)
+    click_threshold = FloatField(null=True)
     task = ForeignKeyField(Task, backref="operations", on_delete="CASCADE")
+    # 在 task 中的顺序, 和 Task.position 一样
+    position = FloatField(null=True)
 
     class Meta:
         database = db
         table_name = "operations"
+        indexes = ((("task", "position"), False),)
+
+    def save(self, *args, **kwargs):
+        # 新建的 operation 放到最后
+        if self.position is None:
+            self.position = next_position(
+                Operation.select().where(Operation.task == self.task_id),
+                Operation.position,
+            )
+        return super().save(*args, **kwargs)
@@ -0,0 +1,87 @@
+from peewee import fn
+
+# 相邻两项之间的初始间隔, 插入到中间时取两边的平均值
+POSITION_GAP = 1024.0
+# 间隔小于这个值时重新编号, 避免浮点数精度不够
+MIN_POSITION_GAP = 1e-6
+
+
+def next_position(query, field):
+    """query 中最后一项之后的位置"""
+    last = query.select(fn.MAX(field)).scalar()
+    if last is None:
+        return POSITION_GAP
+    return last + POSITION_GAP
+
+
+def position_between(before, after):
+    """before 和 after 之间的位置, 为 None 表示在最前面或最后面"""
+    if before is None and after is None:
+        return POSITION_GAP
+    if before is None:
+        return after - POSITION_GAP
+    if after is None:
+        return before + POSITION_GAP
+    return (before + after) / 2
+
+
+def renumber(items):
+    """按 items 的顺序重新编号, 会更新所有行"""
+    if not items:
+        return 0
+    for i, item in enumerate(items, 1):
+        item.position = i * POSITION_GAP
+    model = type(items[0])
+    model.bulk_update(items, fields=[model.position])
+    return len(items)
+
+
+def _find_moved(old, new):
+    """新顺序只是把一项挪了位置时, 返回它在新顺序里的下标, 否则返回 None"""
+    start = 0
+    while start < len(new) and new[start] is old[start]:
+        start += 1
+    end = len(new) - 1
+    while end > start and new[end] is old[end]:
+        end -= 1
+    # 往前挪: 原来在 end 的挪到了 start
+    if new[start] is old[end] and new[start + 1 : end + 1] == old[start:end]:
+        return start
+    # 往后挪: 原来在 start 的挪到了 end
+    if new[end] is old[start] and new[start:end] == old[start + 1 : end + 1]:
+        return end
+    return None
+
+
+def reorder(items):
+    """
+    保存拖拽后的新顺序, 返回更新的行数
+
+    只挪了一项时只更新这一项的 position, 其他情况 (或者间隔太小) 时全部重新编号
+    """
+    items = list(items)
+    old = sorted(
+        items,
+        key=lambda item: (item.position is None, item.position or 0.0, item.id),
+    )
+    if [item.id for item in old] == [item.id for item in items]:
+        return 0
+    if any(item.position is None for item in items):
+        return renumber(items)
+
+    index = _find_moved(old, items)
+    if index is None:
+        return renumber(items)
+
+    before = items[index - 1].position if index > 0 else None
+    after = items[index + 1].position if index + 1 < len(items) else None
+    position = position_between(before, after)
+    if (before is not None and position - before < MIN_POSITION_GAP) or (
+        after is not None and after - position < MIN_POSITION_GAP
+    ):
+        return renumber(items)
+
+    moved = items[index]
+    moved.position = position
+    type(moved).update(position=position).where(type(moved).id == moved.id).execute()
+    return 1
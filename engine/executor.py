@@ -0,0 +1,198 @@
+import time
+import uuid
+from typing import NamedTuple
+
+from loguru import logger
+
+from bot import NikkeBot
+from telemetry import Telemetry
+from db.models import OperationType
+from engine.plan import JobPlan, TaskPlan, OperationPlan
+from engine.scheduler import OperationScheduler
+
+
+class JobRunStats(NamedTuple):
+    job_name: str
+    window_name: str
+    operations: int
+    run_seconds: float
+    # 等待其他任务释放鼠标的时间
+    input_wait_seconds: float
+
+    def operations_per_minute(self):
+        if self.run_seconds <= 0:
+            return 0.0
+        return self.operations / self.run_seconds * 60
+
+
+class JobExecutor:
+    """
+    运行编译好的 JobPlan, 不依赖 PyQt 和数据库
+
+    on_preload_progress(完成数, 总数, 图像路径) 在每个模板解码完成时调用
+    """
+
+    def __init__(
+        self,
+        plan: JobPlan,
+        *,
+        cwd,
+        capture_backend=None,
+        input_backend=None,
+        input_lock=None,
+        focus_before_input=False,
+        default_min_delay=0.0,
+        default_max_delay=5.0,
+        on_preload_progress=None,
+        telemetry_path=None,
+    ):
+        self.plan = plan
+        self.on_preload_progress = on_preload_progress
+        self.bot = NikkeBot(
+            cwd=cwd,
+            window_name=plan.window_name,
+            capture_backend=capture_backend,
+            input_backend=input_backend,
+            input_lock=input_lock,
+            focus_before_input=focus_before_input,
+            telemetry=Telemetry(telemetry_path),
+        )
+        # 代替以前操作之间固定的 1 秒 sleep
+        self.scheduler = OperationScheduler(
+            self.bot,
+            default_min_delay=default_min_delay,
+            default_max_delay=default_max_delay,
+        )
+        self.operations_done = 0
+        self.run_id = None
+
+    def run_job(self):
+        logger.info(f"Running Job: {self.plan.name}")
+
+        # 同一个 executor 可以重复运行, 每次重新统计
+        self.scheduler.timings = []
+        self.operations_done = 0
+        self.bot.input_wait_seconds = 0.0
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        start = time.perf_counter()
+        self.preload()
+
+        with self.bot.input_lock:
+            self.bot.set_foreground()
+        for task in self.plan.tasks:
+            self.run_task(task)
+
+        self.scheduler.report(fixed_delay=1)
+
+        stats = JobRunStats(
+            job_name=self.plan.name,
+            window_name=self.plan.window_name,
+            operations=self.operations_done,
+            run_seconds=time.perf_counter() - start,
+            input_wait_seconds=self.bot.input_wait_seconds,
+        )
+        logger.info(
+            f"Job finished: {self.plan.name}, "
+            f"plan build {self.plan.build_seconds:.3f}s, "
+            f"run {stats.run_seconds:.3f}s, "
+            f"{stats.operations_per_minute():.1f} ops/min, "
+            f"input wait {stats.input_wait_seconds:.3f}s"
+        )
+        return stats
+
+    def preload(self):
+        """在操作游戏窗口之前解码所有模板, 有缺失的图像时直接报错"""
+        img_paths = self.plan.image_paths()
+        start = time.perf_counter()
+
+        def on_progress(done, total, img_path):
+            logger.debug(f"Preloaded {done}/{total}: {img_path}")
+            if self.on_preload_progress:
+                self.on_preload_progress(done, total, img_path)
+
+        failed = self.bot.preload_templates(img_paths, on_progress=on_progress)
+        if failed:
+            for img_path, err in failed.items():
+                logger.error(f"Failed to load image {img_path}: {err}")
+            raise FileNotFoundError(
+                f"{len(failed)} images failed to load: " + ", ".join(failed)
+            )
+
+        if img_paths:
+            self.bot.warm_up(img_paths[0])
+        logger.info(
+            f"Preloaded {len(img_paths)} images in {time.perf_counter() - start:.3f}s"
+        )
+
+    def run_task(self, task: TaskPlan):
+        logger.info(f"Running Task: {task.name}")
+
+        for operation in task.operations:
+            self.run_scheduled_operation(task, operation)
+            self.operations_done += 1
+
+    def run_scheduled_operation(self, task: TaskPlan, operation: OperationPlan):
+        """等待调度器允许后执行操作, 并记录这个操作的 telemetry"""
+        telemetry = self.bot.telemetry
+        telemetry.begin(
+            job=self.plan.name,
+            run_id=self.run_id,
+            task=task.name,
+            operation=operation.name,
+            operation_id=operation.id,
+            operation_type=operation.operation_type.value,
+        )
+        timings_before = len(self.scheduler.timings)
+        error = None
+        try:
+            self.scheduler.run(operation, lambda: self.run_operation(operation))
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            waited = None
+            if len(self.scheduler.timings) > timings_before:
+                waited = self.scheduler.timings[-1].waited
+            telemetry.end(ok=error is None, error=error, waited_seconds=waited)
+
+    def run_operation(self, operation: OperationPlan):
+        ope_type = operation.operation_type
+        if ope_type == OperationType.CLICK_IMG:
+            logger.info(f"Runnning click image operation: {operation.name}")
+            self.bot.click_img_with_retry(
+                operation.click_img,
+                screen=operation.screen_img,
+                job_name=operation.name,
+                click_times=operation.click_times,
+                screen_roi=operation.screen_roi,
+                click_roi=operation.click_roi,
+                pyramid_level=operation.pyramid_level,
+                screen_threshold=operation.screen_threshold,
+                click_threshold=operation.click_threshold,
+            )
+        elif ope_type == OperationType.CLICK_PERCENT:
+            logger.info(f"Runnning click percent operation: {operation.name}")
+            self.bot.click_percent_with_retry(
+                operation.click_percent_x,
+                operation.click_percent_y,
+                screen=operation.click_percent_match_img,
+                job_name=operation.name,
+                click_times=operation.click_times,
+                screen_roi=operation.screen_roi,
+                pyramid_level=operation.pyramid_level,
+                screen_threshold=operation.screen_threshold,
+            )
+        elif ope_type == OperationType.WAIT:
+            logger.info(f"Runnning wait operation: {operation.name}")
+            if operation.is_implicity_wait:
+                time.sleep(operation.wait_timeout)
+            else:
+                self.bot.wait_until_timeout(
+                    operation.screen_img,
+                    operation.wait_timeout,
+                    roi=operation.screen_roi,
+                    pyramid_level=operation.pyramid_level,
+                    threshold=operation.screen_threshold,
+                )
+        else:
+            raise ValueError(f"Unknown operation type: {ope_type}")
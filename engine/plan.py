@@ -0,0 +1,186 @@
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+from db.models import Job, Task, Operation, OperationType
+
+
+class OperationPlan(NamedTuple):
+    id: int
+    name: str
+    operation_type: OperationType
+    ignore_error: bool
+    # 图像路径都已经解析为绝对路径
+    screen_img: Optional[str]
+    click_img: Optional[str]
+    click_percent_x: Optional[float]
+    click_percent_y: Optional[float]
+    click_percent_match_img: Optional[str]
+    click_times: int
+    wait_timeout: Optional[int]
+    is_implicity_wait: bool
+    screen_roi: Optional[tuple]
+    click_roi: Optional[tuple]
+    pyramid_level: int
+    # 已经合并了 task 上的设置, 为 None 时使用调度器的默认值
+    min_delay: Optional[float]
+    max_delay: Optional[float]
+    # 为 None 时使用默认阈值
+    screen_threshold: Optional[float]
+    click_threshold: Optional[float]
+
+    def precondition(self):
+        """返回 (执行前需要检测的页面, match_type), 没有时返回 (None, None)"""
+        if self.operation_type == OperationType.CLICK_IMG:
+            return self.screen_img, "in"
+        if self.operation_type == OperationType.CLICK_PERCENT:
+            if self.click_percent_match_img:
+                return self.click_percent_match_img, "is"
+        return None, None
+
+    def threshold_images(self):
+        """返回 {阈值字段: 用这个阈值匹配的图像}, 没有用到的字段不返回"""
+        screen, _ = self.precondition()
+        if self.operation_type == OperationType.WAIT and not self.is_implicity_wait:
+            screen = self.screen_img
+        images = {"screen_threshold": screen}
+        if self.operation_type == OperationType.CLICK_IMG:
+            images["click_threshold"] = self.click_img
+        return {field: path for field, path in images.items() if path}
+
+    def image_paths(self):
+        """这个操作用到的所有图像"""
+        if self.operation_type == OperationType.CLICK_IMG:
+            paths = [self.screen_img, self.click_img]
+        elif self.operation_type == OperationType.CLICK_PERCENT:
+            paths = [self.click_percent_match_img]
+        elif self.is_implicity_wait:
+            paths = []
+        else:
+            paths = [self.screen_img]
+        return [path for path in paths if path]
+
+
+class TaskPlan(NamedTuple):
+    id: int
+    name: str
+    ignore_error: bool
+    operations: tuple
+
+
+class JobPlan(NamedTuple):
+    """
+    编译好的任务, 运行时不需要再访问数据库
+    """
+
+    id: int
+    name: str
+    window_name: str
+    tasks: tuple
+    build_seconds: float
+
+    def operations(self):
+        for task in self.tasks:
+            yield from task.operations
+
+    def image_paths(self):
+        """去重后的所有图像, 保持第一次出现的顺序"""
+        return list(
+            dict.fromkeys(
+                path for ope in self.operations() for path in ope.image_paths()
+            )
+        )
+
+
+def _resolve(cwd, img_path):
+    if not img_path:
+        return None
+    return Path(cwd).joinpath(img_path).as_posix()
+
+
+def _to_tuple(value):
+    if value is None:
+        return None
+    return tuple(value)
+
+
+def _first_not_none(*values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def compile_operation(operation: Operation, cwd, task: Task = None):
+    return OperationPlan(
+        id=operation.id,
+        name=operation.name,
+        operation_type=OperationType(operation.operation_type),
+        ignore_error=operation.ignore_error,
+        screen_img=_resolve(cwd, operation.screen_img),
+        click_img=_resolve(cwd, operation.click_img),
+        click_percent_x=operation.click_percent_x,
+        click_percent_y=operation.click_percent_y,
+        click_percent_match_img=_resolve(cwd, operation.click_percent_match_img),
+        click_times=operation.click_times,
+        wait_timeout=operation.wait_timeout,
+        is_implicity_wait=operation.is_implicity_wait,
+        screen_roi=_to_tuple(operation.screen_roi),
+        click_roi=_to_tuple(operation.click_roi),
+        pyramid_level=operation.pyramid_level,
+        min_delay=_first_not_none(
+            operation.min_delay, task.min_delay if task else None
+        ),
+        max_delay=_first_not_none(
+            operation.max_delay, task.max_delay if task else None
+        ),
+        screen_threshold=operation.screen_threshold,
+        click_threshold=operation.click_threshold,
+    )
+
+
+def compile_task(task: Task, cwd):
+    operations = []
+    for operation in task.get_orded_operations():
+        if operation.skip_this:
+            logger.info(f"Skipping Operation: {operation.name}")
+            continue
+        operations.append(compile_operation(operation, cwd, task))
+    return TaskPlan(
+        id=task.id,
+        name=task.name,
+        ignore_error=task.ignore_error,
+        operations=tuple(operations),
+    )
+
+
+def compile_job(job: Job, cwd):
+    """
+    把任务从数据库一次性读出来, 跳过的 task 和 operation 不会进入计划
+
+    job 最好用 db.loader.load_job 读出, 否则每个 task 都要再查询一次
+    """
+    start = time.perf_counter()
+    tasks = []
+    for task in job.get_orded_tasks():
+        if task.skip_this:
+            logger.info(f"Skipping Task: {task.name}")
+            continue
+        tasks.append(compile_task(task, cwd))
+    build_seconds = time.perf_counter() - start
+
+    plan = JobPlan(
+        id=job.id,
+        name=job.name,
+        window_name=job.window_name,
+        tasks=tuple(tasks),
+        build_seconds=build_seconds,
+    )
+    logger.info(
+        f"Job plan built: {job.name}, {len(plan.tasks)} tasks, "
+        f"{sum(len(task.operations) for task in plan.tasks)} operations, "
+        f"{build_seconds * 1000:.1f}ms"
+    )
+    return plan
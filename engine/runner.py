@@ -0,0 +1,32 @@
+import threading
+
+from input_backend import INPUT_LOCK
+from engine.executor import JobExecutor
+from engine.plan import JobPlan
+
+_window_locks = {}
+_window_locks_guard = threading.Lock()
+
+
+def window_lock(window_name):
+    """同一个窗口同时只能运行一个任务, 等待的任务不保证按提交顺序运行"""
+    with _window_locks_guard:
+        if window_name not in _window_locks:
+            _window_locks[window_name] = threading.Lock()
+        return _window_locks[window_name]
+
+
+def run_plan(plan: JobPlan, **executor_kwargs):
+    """
+    在当前线程运行一个任务, 截图和匹配可以和其他窗口的任务并行,
+    只有点击阶段通过 INPUT_LOCK 按顺序排队
+
+    每次调用都会创建自己的 JobExecutor, 不要在多个线程之间共用 capture_backend 等参数
+
+    注意 GDI 是按屏幕区域截图的, 同时运行的窗口不能互相遮挡
+    """
+    executor_kwargs.setdefault("input_lock", INPUT_LOCK)
+    executor_kwargs.setdefault("focus_before_input", True)
+    executor = JobExecutor(plan, **executor_kwargs)
+    with window_lock(plan.window_name):
+        return executor.run_job()
@@ -0,0 +1,130 @@
+import time
+from typing import NamedTuple, Optional
+
+from loguru import logger
+
+from db.models import OperationType
+from engine.plan import OperationPlan
+
+
+class OperationTiming(NamedTuple):
+    name: str
+    min_delay: float
+    max_delay: float
+    # 实际在操作之前等待的秒数
+    waited: float
+    # 检测到目标页面时为 True, 等到 max_delay 也没检测到为 False, 没有目标页面为 None
+    detected: Optional[bool]
+    run_seconds: float
+
+
+class OperationScheduler:
+    """
+    决定什么时候开始下一个操作
+
+    先等 min_delay 秒, 之后一检测到操作的目标页面就开始, 最多等 max_delay 秒.
+    没有目标页面的操作会等到画面静止 settle_seconds 秒为止,
+    最多等 settle_timeout 秒 (以前固定 sleep 的时间), 一直有动画时不会更慢.
+    """
+
+    def __init__(
+        self,
+        bot,
+        default_min_delay=0.0,
+        default_max_delay=5.0,
+        settle_seconds=0.3,
+        settle_timeout=1.0,
+    ):
+        self.bot = bot
+        self.default_min_delay = default_min_delay
+        self.default_max_delay = default_max_delay
+        self.settle_seconds = settle_seconds
+        self.settle_timeout = settle_timeout
+        self.timings = []
+
+    def get_delays(self, operation: OperationPlan):
+        min_delay = operation.min_delay
+        if min_delay is None:
+            min_delay = self.default_min_delay
+        max_delay = operation.max_delay
+        if max_delay is None:
+            max_delay = self.default_max_delay
+        return min_delay, max(min_delay, max_delay)
+
+    def wait_before(self, operation: OperationPlan):
+        """返回 (等待的秒数, 是否检测到目标页面)"""
+        min_delay, max_delay = self.get_delays(operation)
+        start = time.perf_counter()
+        if min_delay > 0:
+            time.sleep(min_delay)
+
+        remaining = max(max_delay - min_delay, 0)
+        screen, match_type = operation.precondition()
+        detected = None
+        if screen:
+            elapsed = self.bot.wait_for_screen(
+                screen,
+                remaining,
+                match_type=match_type,
+                roi=operation.screen_roi,
+                pyramid_level=operation.pyramid_level,
+                threshold=operation.screen_threshold,
+            )
+            detected = elapsed is not None
+        elif not self._waits_by_itself(operation):
+            self.bot.wait_until_stable(
+                self.settle_seconds, min(remaining, self.settle_timeout)
+            )
+        return time.perf_counter() - start, detected
+
+    def _waits_by_itself(self, operation: OperationPlan):
+        # 等待操作自己会检测页面或者固定等待, 不需要再等画面静止
+        return operation.operation_type == OperationType.WAIT
+
+    def run(self, operation: OperationPlan, func):
+        """等待合适的时机执行 func, 并记录时间"""
+        waited, detected = self.wait_before(operation)
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            min_delay, max_delay = self.get_delays(operation)
+            self.timings.append(
+                OperationTiming(
+                    name=operation.name,
+                    min_delay=min_delay,
+                    max_delay=max_delay,
+                    waited=waited,
+                    detected=detected,
+                    run_seconds=time.perf_counter() - start,
+                )
+            )
+
+    def report(self, fixed_delay=None):
+        """
+        输出每个操作实际等待和配置的对比
+
+        fixed_delay 为以前固定 sleep 的秒数, 用来估算节省的时间
+        """
+        lines = [
+            f"{'operation':<30} {'min':>6} {'max':>6} {'waited':>7} "
+            f"{'detected':>8} {'run':>7}"
+        ]
+        for timing in self.timings:
+            detected = "-" if timing.detected is None else str(timing.detected)
+            lines.append(
+                f"{timing.name[:30]:<30} {timing.min_delay:>6.2f} "
+                f"{timing.max_delay:>6.2f} {timing.waited:>7.2f} "
+                f"{detected:>8} {timing.run_seconds:>7.2f}"
+            )
+        total_waited = sum(timing.waited for timing in self.timings)
+        lines.append(f"total waited: {total_waited:.2f}s")
+        if fixed_delay is not None:
+            fixed_total = fixed_delay * len(self.timings)
+            lines.append(
+                f"fixed {fixed_delay}s delays would wait {fixed_total:.2f}s, "
+                f"saved {fixed_total - total_waited:.2f}s"
+            )
+        report = "\n".join(lines)
+        logger.info(f"Operation timing report:\n{report}")
+        return report
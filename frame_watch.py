@@ -0,0 +1,63 @@
+import cv2
+
+from matcher import crop_roi
+
+
+def frame_thumbnail(screen_gray, size=(64, 36)):
+    """缩小后的灰度图, 用来便宜地判断画面有没有变化"""
+    return cv2.resize(screen_gray, size, interpolation=cv2.INTER_AREA)
+
+
+class FrameChangeDetector:
+    """
+    比较缩略图, 差值超过 pixel_threshold 的像素有 min_pixels 个以上时认为画面变了
+
+    缩略图可以过滤掉截图本身的细微噪声, 设置了 roi 时只比较这个区域;
+    按变化的像素个数而不是平均值判断, 一个小按钮出现也能检测到
+    (1080p 下 240x120 的按钮在 64x36 的缩略图中约占 8x4 个像素)
+    """
+
+    def __init__(self, size=(64, 36), pixel_threshold=8, min_pixels=1, roi=None):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.min_pixels = min_pixels
+        self.roi = roi
+        self._last = None
+
+    def reset(self):
+        self._last = None
+
+    def diff(self, screen_gray):
+        """
+        和上一帧相比变化的像素个数, 没有上一帧时返回 inf, 不会更新上一帧
+
+        返回 (像素个数, 缩略图)
+        """
+        if self.roi:
+            cropped, _ = crop_roi(screen_gray, self.roi)
+            if cropped.size:
+                screen_gray = cropped
+        thumbnail = frame_thumbnail(screen_gray, self.size)
+        if self._last is None or self._last.shape != thumbnail.shape:
+            return float("inf"), thumbnail
+        changed_pixels = cv2.countNonZero(
+            cv2.threshold(
+                cv2.absdiff(thumbnail, self._last),
+                self.pixel_threshold,
+                255,
+                cv2.THRESH_BINARY,
+            )[1]
+        )
+        return changed_pixels, thumbnail
+
+    def is_changed(self, value):
+        """diff 返回的像素个数是否算画面变了"""
+        return value >= self.min_pixels
+
+    def changed(self, screen_gray):
+        """画面变了时返回 True 并记住这一帧"""
+        value, thumbnail = self.diff(screen_gray)
+        if not self.is_changed(value):
+            return False
+        self._last = thumbnail
+        return True
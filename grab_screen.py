@@ -1,3 +1,5 @@
+import ctypes
+import cv2
 import numpy as np
 import win32gui
 import win32ui
@@ -39,6 +41,164 @@ def grab_screen(region=None):
     return img
 
 
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [
+        ("biSize", ctypes.c_uint32),
+        ("biWidth", ctypes.c_int32),
+        ("biHeight", ctypes.c_int32),
+        ("biPlanes", ctypes.c_uint16),
+        ("biBitCount", ctypes.c_uint16),
+        ("biCompression", ctypes.c_uint32),
+        ("biSizeImage", ctypes.c_uint32),
+        ("biXPelsPerMeter", ctypes.c_int32),
+        ("biYPelsPerMeter", ctypes.c_int32),
+        ("biClrUsed", ctypes.c_uint32),
+        ("biClrImportant", ctypes.c_uint32),
+    ]
+
+
+BI_RGB = 0
+DIB_RGB_COLORS = 0
+
+_get_dibits = None
+
+
+def _get_dibits_func():
+    """
+    声明好参数类型的 GetDIBits, 只在第一次调用时设置
+
+    pywin32 返回的句柄是 python int, 不声明 argtypes 时 ctypes 会按 32 位 int 传,
+    64 位系统上句柄超过范围时会报 "int too long to convert"
+    """
+    global _get_dibits
+    if _get_dibits is None:
+        from ctypes import wintypes
+
+        func = ctypes.windll.gdi32.GetDIBits
+        func.argtypes = [
+            wintypes.HDC,
+            wintypes.HBITMAP,
+            wintypes.UINT,
+            wintypes.UINT,
+            wintypes.LPVOID,
+            ctypes.POINTER(BITMAPINFOHEADER),
+            wintypes.UINT,
+        ]
+        func.restype = ctypes.c_int
+        _get_dibits = func
+    return _get_dibits
+
+
+class ScreenGrabber:
+    """
+    和 grab_screen 一样截图, 但 DC 和位图在多次截图之间复用
+
+    只有截图区域大小变化时才重新创建, 返回的数组会在下次 grab 时被覆盖
+    """
+
+    def __init__(self):
+        self.hwin = win32gui.GetDesktopWindow()
+        self._hwindc = None
+        self._srcdc = None
+        self._memdc = None
+        self._bmp = None
+        self._size = None
+        self._buffer = None
+        self._gray_buffer = None
+        self._bmi = BITMAPINFOHEADER()
+        self._bmi.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+        self._bmi.biPlanes = 1
+        self._bmi.biBitCount = 32
+        self._bmi.biCompression = BI_RGB
+
+    def _allocate(self, width, height):
+        self.release()
+        self._hwindc = win32gui.GetWindowDC(self.hwin)
+        self._srcdc = win32ui.CreateDCFromHandle(self._hwindc)
+        self._memdc = self._srcdc.CreateCompatibleDC()
+        self._bmp = win32ui.CreateBitmap()
+        self._bmp.CreateCompatibleBitmap(self._srcdc, width, height)
+        self._memdc.SelectObject(self._bmp)
+        self._size = (width, height)
+        self._buffer = np.empty((height, width, 4), dtype="uint8")
+        self._gray_buffer = np.empty((height, width), dtype="uint8")
+        self._bmi.biWidth = width
+        self._bmi.biHeight = -height  # 负数为从上到下的行顺序, 和 GetBitmapBits 一致
+
+    @staticmethod
+    def _region_geometry(region):
+        if region:
+            left, top, x2, y2 = region
+            return left, top, x2 - left + 1, y2 - top + 1
+        return (
+            win32api.GetSystemMetrics(win32con.SM_XVIRTUALSCREEN),
+            win32api.GetSystemMetrics(win32con.SM_YVIRTUALSCREEN),
+            win32api.GetSystemMetrics(win32con.SM_CXVIRTUALSCREEN),
+            win32api.GetSystemMetrics(win32con.SM_CYVIRTUALSCREEN),
+        )
+
+    def _ensure_size(self, width, height):
+        # 只是窗口移动时不需要重新创建, BitBlt 的源坐标变了而已
+        if self._size != (width, height):
+            self._allocate(width, height)
+
+    def prepare(self, region=None):
+        """按区域大小提前创建位图, 窗口大小变化时不用等到下次截图"""
+        _, _, width, height = self._region_geometry(region)
+        self._ensure_size(width, height)
+
+    def grab(self, region=None):
+        left, top, width, height = self._region_geometry(region)
+        self._ensure_size(width, height)
+        if not self._copy_bits(left, top, width, height):
+            # DC 或位图可能已经失效 (例如显示设置变了), 重新创建后再试一次
+            self._allocate(width, height)
+            if not self._copy_bits(left, top, width, height):
+                raise OSError(f"GetDIBits 失败: {width}x{height}")
+        return self._buffer
+
+    def _copy_bits(self, left, top, width, height):
+        """截图到 buffer, 返回 GetDIBits 复制的行数, 失败时为 0"""
+        self._memdc.BitBlt(
+            (0, 0), (width, height), self._srcdc, (left, top), win32con.SRCCOPY
+        )
+        # 直接把像素写进复用的 buffer, 不经过 bytes
+        return _get_dibits_func()(
+            self._memdc.GetSafeHdc(),
+            self._bmp.GetHandle(),
+            0,
+            height,
+            self._buffer.ctypes.data_as(ctypes.c_void_p),
+            ctypes.byref(self._bmi),
+            DIB_RGB_COLORS,
+        )
+
+    def grab_gray(self, region=None):
+        """截图并直接转换到复用的灰度 buffer 中"""
+        bgra = self.grab(region)
+        cv2.cvtColor(bgra, cv2.COLOR_BGRA2GRAY, dst=self._gray_buffer)
+        return self._gray_buffer
+
+    def release(self):
+        if self._size is None:
+            return
+        self._srcdc.DeleteDC()
+        self._memdc.DeleteDC()
+        win32gui.ReleaseDC(self.hwin, self._hwindc)
+        win32gui.DeleteObject(self._bmp.GetHandle())
+        self._hwindc = None
+        self._srcdc = None
+        self._memdc = None
+        self._bmp = None
+        self._size = None
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass
+
+
 def get_window_rect(window_name):
     hwnd = win32gui.FindWindow(None, window_name)
     if hwnd:
@@ -0,0 +1,228 @@
+import ctypes
+import json
+import threading
+import time
+
+INPUT_MOUSE = 0
+MOUSEEVENTF_LEFTDOWN = 0x0002
+MOUSEEVENTF_LEFTUP = 0x0004
+
+
+class MouseInput(ctypes.Structure):
+    _fields_ = [
+        ("dx", ctypes.c_long),
+        ("dy", ctypes.c_long),
+        ("mouseData", ctypes.c_ulong),
+        ("dwFlags", ctypes.c_ulong),
+        ("time", ctypes.c_ulong),
+        ("dwExtraInfo", ctypes.POINTER(ctypes.c_ulong)),
+    ]
+
+
+class KeyBdInput(ctypes.Structure):
+    _fields_ = [
+        ("wVk", ctypes.c_ushort),
+        ("wScan", ctypes.c_ushort),
+        ("dwFlags", ctypes.c_ulong),
+        ("time", ctypes.c_ulong),
+        ("dwExtraInfo", ctypes.POINTER(ctypes.c_ulong)),
+    ]
+
+
+class HardwareInput(ctypes.Structure):
+    _fields_ = [
+        ("uMsg", ctypes.c_ulong),
+        ("wParamL", ctypes.c_short),
+        ("wParamH", ctypes.c_ushort),
+    ]
+
+
+class Input_I(ctypes.Union):
+    _fields_ = [("ki", KeyBdInput), ("mi", MouseInput), ("hi", HardwareInput)]
+
+
+class Input(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_ulong), ("ii", Input_I)]
+
+
+class FairLock:
+    """
+    按申请顺序获得的可重入锁, 多个任务同时操作鼠标时不会有任务一直抢不到
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._cond.wait()
+            self._owner = me
+            self._depth = 1
+
+    def release(self):
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("release unlocked FairLock")
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._serving += 1
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+# 全局只有一个鼠标, 所有任务的输入阶段都要拿到这个锁
+INPUT_LOCK = FairLock()
+
+
+class InputBackend:
+    """
+    鼠标输入的接口
+
+    click_hold 为按下到松开的时间, click_interval 为多次点击之间的间隔, 单位秒
+    """
+
+    def __init__(self, click_hold=0.05, click_interval=0.05):
+        self.click_hold = click_hold
+        self.click_interval = click_interval
+
+    def mouse_move(self, x, y):
+        raise NotImplementedError
+
+    def mouse_down(self):
+        raise NotImplementedError
+
+    def mouse_up(self):
+        raise NotImplementedError
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def click(self, times=1):
+        for i in range(times):
+            if i > 0:
+                self.sleep(self.click_interval)
+            self.mouse_down()
+            self.sleep(self.click_hold)
+            self.mouse_up()
+
+
+class AutoItInputBackend(InputBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # autoit 只有 Windows 上有, 用到的时候再导入
+        import autoit
+
+        self._autoit = autoit
+
+    def mouse_move(self, x, y):
+        self._autoit.mouse_move(x, y)
+
+    def mouse_down(self):
+        self._autoit.mouse_down("left")
+
+    def mouse_up(self):
+        self._autoit.mouse_up("left")
+
+
+class SendInputBackend(InputBackend):
+    """直接调用 user32.SendInput, 不需要 AutoIt"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._user32 = ctypes.windll.user32
+        self._extra = ctypes.c_ulong(0)
+
+    def _send_mouse(self, flags):
+        event = Input(
+            type=ctypes.c_ulong(INPUT_MOUSE),
+            ii=Input_I(mi=MouseInput(0, 0, 0, flags, 0, ctypes.pointer(self._extra))),
+        )
+        self._user32.SendInput(1, ctypes.pointer(event), ctypes.sizeof(event))
+
+    def mouse_move(self, x, y):
+        self._user32.SetCursorPos(int(x), int(y))
+
+    def mouse_down(self):
+        self._send_mouse(MOUSEEVENTF_LEFTDOWN)
+
+    def mouse_up(self):
+        self._send_mouse(MOUSEEVENTF_LEFTUP)
+
+
+class RecordingInputBackend(InputBackend):
+    """
+    不操作鼠标, 只记录带时间戳的事件, 用于测试和无窗口运行
+
+    real_sleep 为 False 时不真的等待, path 不为空时事件会追加写入 jsonl 文件
+    """
+
+    def __init__(self, path=None, real_sleep=False, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.real_sleep = real_sleep
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _record(self, event, **data):
+        record = {"ts": time.time(), "event": event, **data}
+        with self._lock:
+            self.events.append(record)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def mouse_move(self, x, y):
+        self._record("move", x=int(x), y=int(y))
+
+    def mouse_down(self):
+        self._record("down")
+
+    def mouse_up(self):
+        self._record("up")
+
+    def sleep(self, seconds):
+        if self.real_sleep:
+            time.sleep(seconds)
+
+    def clicks(self):
+        """返回每次点击的坐标"""
+        result = []
+        position = None
+        for record in self.events:
+            if record["event"] == "move":
+                position = (record["x"], record["y"])
+            elif record["event"] == "down":
+                result.append(position)
+        return result
+
+
+def make_input_backend(spec=None, **kwargs):
+    """
+    根据字符串创建输入后端: "autoit", "sendinput", "recording[:<jsonl路径>]"
+    """
+    if not spec or spec == "autoit":
+        return AutoItInputBackend(**kwargs)
+    if spec == "sendinput":
+        return SendInputBackend(**kwargs)
+    if spec == "recording" or spec.startswith("recording:"):
+        path = spec[len("recording:") :] or None
+        return RecordingInputBackend(path, **kwargs)
+    raise ValueError(f"未知的输入后端 '{spec}'")
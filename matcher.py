@@ -0,0 +1,195 @@
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+
+class MatchBox(NamedTuple):
+    x: int
+    y: int
+    w: int
+    h: int
+    score: float
+
+    def center(self):
+        return self.x + self.w // 2, self.y + self.h // 2
+
+
+def match_template(screen_gray, template_gray):
+    """返回 matchTemplate 的结果矩阵, 模板比截图大时返回 None"""
+    if (
+        template_gray.shape[0] > screen_gray.shape[0]
+        or template_gray.shape[1] > screen_gray.shape[1]
+    ):
+        return None
+    return cv2.matchTemplate(screen_gray, template_gray, cv2.TM_CCOEFF_NORMED)
+
+
+def best_match(screen_gray, template_gray, pyramid_level=0):
+    """返回 (最高分, 左上角坐标), 无法匹配时返回 (0.0, None)"""
+    if pyramid_level > 0:
+        return pyramid_best_match(screen_gray, template_gray, pyramid_level)
+    result = match_template(screen_gray, template_gray)
+    if result is None:
+        return 0.0, None
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    return max_val, max_loc
+
+
+# 缩小后模板边长小于这个值时, 粗匹配没有意义, 直接用原图匹配
+PYRAMID_MIN_TEMPLATE_SIZE = 8
+
+
+def pyramid_best_match(screen_gray, template_gray, level=2, candidates=3):
+    """
+    先在缩小 2**level 倍的图上找候选位置, 再在原图的候选附近精确匹配
+
+    返回的分数和位置都是原图上的结果, 和 best_match 一致
+    """
+    scale = 2**level
+    template_h, template_w = template_gray.shape[:2]
+    if min(template_h, template_w) // scale < PYRAMID_MIN_TEMPLATE_SIZE:
+        return best_match(screen_gray, template_gray)
+
+    small_screen = cv2.resize(
+        screen_gray, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA
+    )
+    small_template = cv2.resize(
+        template_gray, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA
+    )
+    result = match_template(small_screen, small_template)
+    if result is None:
+        return 0.0, None
+
+    screen_h, screen_w = screen_gray.shape[:2]
+    small_h, small_w = small_template.shape[:2]
+    margin = scale + 2
+    best_val, best_loc = 0.0, None
+    for _ in range(candidates):
+        _, max_val, _, (small_x, small_y) = cv2.minMaxLoc(result)
+        if max_val <= 0:
+            break
+        # 抑制这个候选附近的位置, 下一轮找别的候选
+        result[
+            max(small_y - small_h // 2, 0) : small_y + small_h // 2 + 1,
+            max(small_x - small_w // 2, 0) : small_x + small_w // 2 + 1,
+        ] = -1
+
+        left = max(small_x * scale - margin, 0)
+        top = max(small_y * scale - margin, 0)
+        right = min(small_x * scale + margin + template_w, screen_w)
+        bottom = min(small_y * scale + margin + template_h, screen_h)
+        val, loc = best_match(screen_gray[top:bottom, left:right], template_gray)
+        if loc is not None and val > best_val:
+            best_val, best_loc = val, (loc[0] + left, loc[1] + top)
+    return best_val, best_loc
+
+
+def crop_roi(screen_gray, roi):
+    """
+    roi 为窗口的比例 (x, y, w, h), 取值 0~1, 这样窗口大小变化也能用
+
+    返回 (裁剪后的图像, 左上角偏移)
+    """
+    screen_h, screen_w = screen_gray.shape[:2]
+    x, y, w, h = roi
+    left = min(max(int(x * screen_w), 0), screen_w)
+    top = min(max(int(y * screen_h), 0), screen_h)
+    right = min(max(int((x + w) * screen_w + 0.5), left), screen_w)
+    bottom = min(max(int((y + h) * screen_h + 0.5), top), screen_h)
+    return screen_gray[top:bottom, left:right], (left, top)
+
+
+def best_match_in_roi(screen_gray, template_gray, roi, threshold, pyramid_level=0):
+    """先在 roi 内匹配, 分数不够时再对整个页面匹配"""
+    if roi:
+        cropped, (offset_x, offset_y) = crop_roi(screen_gray, roi)
+        max_val, max_loc = best_match(cropped, template_gray, pyramid_level)
+        if max_val >= threshold:
+            return max_val, (max_loc[0] + offset_x, max_loc[1] + offset_y)
+    return best_match(screen_gray, template_gray, pyramid_level)
+
+
+def scale_candidates(scale_range, step=0.1):
+    """
+    scale_range 为 (最小, 最大), 返回其中所有缩放比例, 离 1.0 近的在前面
+
+    为 None 时只有 1.0, 也就是不做多尺度匹配
+    """
+    if not scale_range:
+        return [1.0]
+    low, high = scale_range
+    count = int(round((high - low) / step)) + 1
+    scales = {round(low + i * step, 3) for i in range(count)} | {1.0}
+    return sorted(scales, key=lambda scale: (round(abs(scale - 1.0), 3), scale))
+
+
+def scale_template(template_gray, scale):
+    """缩放模板, 缩小用 INTER_AREA, 放大用 INTER_LINEAR"""
+    if scale == 1.0:
+        return template_gray
+    h, w = template_gray.shape[:2]
+    size = (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1))
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    scaled = cv2.resize(template_gray, size, interpolation=interpolation)
+    scaled.setflags(write=False)
+    return scaled
+
+
+def match_cost(screen_shape, template_shape):
+    """matchTemplate 的大致计算量, 用来决定匹配顺序"""
+    result_h = max(screen_shape[0] - template_shape[0] + 1, 0)
+    result_w = max(screen_shape[1] - template_shape[1] + 1, 0)
+    return result_h * result_w * template_shape[0] * template_shape[1]
+
+
+def non_max_suppression(boxes, scores, iou_threshold=0.3):
+    """
+    boxes 为 (n, 4) 的 [x1, y1, x2, y2], 返回保留下来的下标, 按分数从高到低
+    """
+    if len(boxes) == 0:
+        return []
+    boxes = boxes.astype(np.float32)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(scores)[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        inter_w = np.clip(
+            np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None
+        )
+        inter_h = np.clip(
+            np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None
+        )
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+
+def find_all_matches(result, template_shape, threshold, iou_threshold=0.3):
+    """
+    从 matchTemplate 的结果里找出所有匹配, 返回按分数排序的 MatchBox 列表
+
+    先只保留局部最大值, 再用 NMS 去掉重叠的框
+    """
+    template_h, template_w = template_shape[:2]
+    # 邻域取模板一半大小, 同一个目标周围的高分像素只留下峰值
+    kernel_w = max(template_w // 2, 1) | 1
+    kernel_h = max(template_h // 2, 1) | 1
+    dilated = cv2.dilate(result, np.ones((kernel_h, kernel_w), np.uint8))
+    ys, xs = np.nonzero((result >= threshold) & (result >= dilated))
+    if len(xs) == 0:
+        return []
+
+    scores = result[ys, xs]
+    boxes = np.stack([xs, ys, xs + template_w, ys + template_h], axis=1)
+    keep = non_max_suppression(boxes, scores, iou_threshold)
+    return [
+        MatchBox(int(xs[i]), int(ys[i]), template_w, template_h, float(scores[i]))
+        for i in keep
+    ]
@@ -3,61 +3,490 @@ import fire
 import json
 import os
 from pathlib import Path
+import shutil
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
+import numpy as np
+from peewee import OperationalError
 
-from db.models import init_db, Job, Task, Operation
+from db.models import (
+    db,
+    init_db,
+    Job,
+    Task,
+    Operation,
+    SQLITE_PRAGMAS,
+    SQLITE_BUSY_TIMEOUT,
+)
+from db.loader import load_job_tree
+from db.ordering import POSITION_GAP
+from db.migrations import migrate_order_arrays
+from db.dump import dump_ndjson, iter_legacy_rows, iter_ndjson_rows, load_rows
+from bot import NikkeBot
+from capture import ReplayCaptureBackend, make_capture_backend
+from input_backend import make_input_backend
+from engine.plan import compile_job, compile_operation
+from engine.executor import JobExecutor
+from logger import init_logger
+from telemetry import read_records
+from settings import TELEMETRY_FILE
+from matcher import best_match
+from template_cache import decode_image
+from threshold_tuning import collect_scores, recommend_threshold, score_histogram
 
 CWD = Path(os.getcwd())
 
 
 class Mng:
-    def dumpdb(self, path="db.json"):
+    def dumpdb(self, path="db.ndjson"):
+        """
+        逐行导出数据库, 每行一个 {"model": ..., "data": {...}}, 内存占用不随数据量增长
+        """
         logger.info("Dumping Database")
 
         init_db()
-        jobs = Job.select()
+        start = time.perf_counter()
+        with open(path, "w", encoding="utf-8") as f:
+            counts = dump_ndjson(f)
+        self._log_rows("dumped to", path, counts, time.perf_counter() - start)
+
+    def loaddb(self, path="db.ndjson"):
+        """
+        Insert data from a dumpdb file to the database.
+
+        支持 dumpdb 导出的 ndjson 和旧版本的嵌套 json, 每批用同一条 INSERT 执行 executemany,
+        全部在一个事务里, 中途出错不会留下一半的数据
+
+        数据里的 id 会原样插入, 导入到已有数据的数据库时可能冲突, 最好先删除 db.sqlite3
+        """
+        logger.info("Loading Database")
 
-        jobs_data = []
-        for job in jobs:
-            job_data = dict(job.__data__)
-            tasks_data = []
-            for task in job.tasks:
-                task_data = dict(task.__data__)
-                task_data["operations"] = [
-                    dict(ope.__data__) for ope in task.operations
-                ]
-                tasks_data.append(task_data)
-            job_data["tasks"] = tasks_data
-            jobs_data.append(job_data)
+        init_db()
+        start = time.perf_counter()
+        with open(path, "r", encoding="utf-8") as f:
+            first = f.read(1)
+            while first.isspace():
+                first = f.read(1)
+            f.seek(0)
+            if first == "[":
+                # 旧版本的格式只能整个读进来
+                counts = load_rows(iter_legacy_rows(json.load(f)))
+            else:
+                counts = load_rows(iter_ndjson_rows(f))
+        migrate_order_arrays(db, Job, Task, Operation)
+        self._log_rows("loaded from", path, counts, time.perf_counter() - start)
 
-        json_data = json.dumps(jobs_data, indent=4)
-        with open(path, "w") as f:
-            f.write(json_data)
+    def _log_rows(self, action, path, counts, seconds):
+        total = sum(counts.values())
+        detail = ", ".join(f"{count} {name}s" for name, count in counts.items())
+        logger.info(
+            f"Database {action} {path}: {detail} in {seconds:.2f}s "
+            f"({total / max(seconds, 1e-9):.0f} rows/s)"
+        )
 
-        logger.info(f"Database dumped to {path}")
+    def checkpyramid(self, frames_dir, img_path, level=2, tolerance=2, threshold=0.8):
+        """
+        用录制的截图检查金字塔匹配和原图匹配的结果是否一致
 
-    def loaddb(self, path="db.json"):
+        只检查原图匹配分数超过 threshold 的截图, 位置误差超过 tolerance 像素算不一致
         """
-        Insert data from a json file to the database.
+        logger.info(f"Checking pyramid matcher: {img_path} (level {level})")
+
+        _, template = decode_image(img_path)
+        frame_paths = sorted(
+            p
+            for p in Path(frames_dir).iterdir()
+            if p.suffix.lower() in (".png", ".jpg", ".jpeg", ".bmp")
+        )
+
+        checked = 0
+        mismatched = 0
+        full_time = 0.0
+        pyramid_time = 0.0
+        for frame_path in frame_paths:
+            _, frame = decode_image(frame_path)
+
+            start = time.perf_counter()
+            full_val, full_loc = best_match(frame, template)
+            full_time += time.perf_counter() - start
+            start = time.perf_counter()
+            pyramid_val, pyramid_loc = best_match(frame, template, level)
+            pyramid_time += time.perf_counter() - start
+
+            if full_val < threshold:
+                continue
+            checked += 1
+            if (
+                pyramid_val < threshold
+                or abs(full_loc[0] - pyramid_loc[0]) > tolerance
+                or abs(full_loc[1] - pyramid_loc[1]) > tolerance
+            ):
+                mismatched += 1
+                logger.warning(
+                    f"Mismatch in {frame_path.name}: "
+                    f"full {full_val:.3f}@{full_loc}, "
+                    f"pyramid {pyramid_val:.3f}@{pyramid_loc}"
+                )
 
-        如果修改了数据库模型, 你需要先删除 db.sqlite3 文件
+        logger.info(
+            f"Checked {checked}/{len(frame_paths)} frames, {mismatched} mismatched, "
+            f"full {full_time:.3f}s, pyramid {pyramid_time:.3f}s"
+        )
+        return mismatched == 0
 
-        如果你修改了数据库模型, 又没有设置default值, 那你需要手动修改json文件或者这个函数
+    def benchmatch(self, source, img_path, iterations=100, pyramid_level=0):
         """
-        logger.info("Loading Database")
+        用录制的画面 (截图目录或视频) 测试截图和匹配的速度, 不需要游戏窗口
+        """
+        logger.info(f"Benchmarking match: {img_path} on {source}")
+
+        backend = ReplayCaptureBackend(source, realtime=False, loop=True)
+        bot = NikkeBot(
+            cwd=CWD,
+            window_name="replay",
+            capture_backend=backend,
+            pyramid_level=pyramid_level,
+        )
+        bot.get_gray_img(img_path)  # 不把第一次解码算进去
+
+        capture_time = 0.0
+        match_time = 0.0
+        matched = 0
+        for _ in range(iterations):
+            with bot.frame():
+                start = time.perf_counter()
+                bot.get_game_screen_gray()
+                capture_time += time.perf_counter() - start
+                start = time.perf_counter()
+                if bot.is_screen(img_path):
+                    matched += 1
+                match_time += time.perf_counter() - start
+        backend.close()
+
+        total = capture_time + match_time
+        logger.info(
+            f"{iterations} frames, {matched} matched, "
+            f"capture {capture_time / iterations * 1000:.2f}ms/frame, "
+            f"match {match_time / iterations * 1000:.2f}ms/frame, "
+            f"{iterations / total:.1f} frames/s"
+        )
+
+    def benchdb(self, path="db.sqlite3", readers=4, seconds=5.0, wal=True):
+        """
+        数据库并发测试: 主线程 (相当于 UI 线程) 不停修改 operation,
+        readers 个工作线程不停读取整个 job 树, 输出每种操作的次数, 延迟和锁错误
+
+        在 path 的副本上测试, 不会修改原数据库; path 不存在时生成测试数据
+        --wal=False 使用 sqlite 默认的 rollback journal 对比
+        """
+        tmp_dir = tempfile.mkdtemp(prefix="benchdb-")
+        bench_path = os.path.join(tmp_dir, "bench.sqlite3")
+        if os.path.exists(path):
+            with sqlite3.connect(path) as src, sqlite3.connect(bench_path) as dst:
+                src.backup(dst)
+
+        pragmas = SQLITE_PRAGMAS if wal else {"journal_mode": "delete"}
+        db.init(bench_path, pragmas=pragmas, timeout=SQLITE_BUSY_TIMEOUT)
+        init_db()
+        if Operation.select().count() == 0:
+            self._seed_bench_db()
+        operation_ids = [ope.id for ope in Operation.select(Operation.id)]
+        journal_mode = db.execute_sql("PRAGMA journal_mode").fetchone()[0]
+        logger.info(
+            f"Benchmarking {bench_path} ({journal_mode}), "
+            f"{len(operation_ids)} operations, {readers} readers, {seconds}s"
+        )
+
+        stop = threading.Event()
+        results = {}
+        lock = threading.Lock()
+
+        def record(role, latency, error):
+            with lock:
+                stats = results.setdefault(role, {"latencies": [], "errors": 0})
+                if error:
+                    stats["errors"] += 1
+                else:
+                    stats["latencies"].append(latency)
 
-        with open(path, "r") as f:
-            data = json.load(f)
+        def reader():
+            with db.connection_context():
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        load_job_tree()
+                        record("read", time.perf_counter() - start, False)
+                    except OperationalError:
+                        record("read", None, True)
 
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+
+        deadline = time.perf_counter() + seconds
+        i = 0
+        while time.perf_counter() < deadline:
+            ope_id = operation_ids[i % len(operation_ids)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                with db.atomic():
+                    Operation.update(name=f"bench {i}").where(
+                        Operation.id == ope_id
+                    ).execute()
+                record("write", time.perf_counter() - start, False)
+            except OperationalError:
+                record("write", None, True)
+            time.sleep(0.01)  # 编辑的频率远低于读取
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+        db.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        lines = [
+            f"{'role':<6} {'count':>7} {'per_s':>8} {'p50_ms':>8} "
+            f"{'p95_ms':>8} {'max_ms':>8} {'errors':>7}"
+        ]
+        for role, stats in sorted(results.items()):
+            latencies = np.array(stats["latencies"] or [float("nan")]) * 1000
+            count = len(stats["latencies"])
+            lines.append(
+                f"{role:<6} {count:>7} {count / seconds:>8.1f} "
+                f"{np.percentile(latencies, 50):>8.2f} "
+                f"{np.percentile(latencies, 95):>8.2f} "
+                f"{latencies.max():>8.2f} {stats['errors']:>7}"
+            )
+        print("\n".join(lines))
+
+    def _seed_bench_db(self, jobs=10, tasks=20, operations=15):
+        with db.atomic():
+            for j in range(jobs):
+                job = Job.create(name=f"bench job {j}", window_name="bench")
+                for t in range(tasks):
+                    task = Task.create(name=f"bench task {t}", job=job)
+                    Operation.insert_many(
+                        [
+                            {
+                                "name": f"bench operation {o}",
+                                "operation_type": "wait",
+                                "is_implicity_wait": True,
+                                "wait_timeout": 1,
+                                "task": task,
+                                "position": (o + 1) * POSITION_GAP,
+                            }
+                            for o in range(operations)
+                        ]
+                    ).execute()
+
+    def run_job(
+        self,
+        name,
+        repeat=1,
+        capture_backend="gdi",
+        input_backend="autoit",
+        timing_output=None,
+        telemetry_output=TELEMETRY_FILE,
+        default_max_delay=5.0,
+    ):
+        """
+        不启动 studio, 直接运行任务, 可以放进计划任务或者 cron
+
+        capture_backend: "gdi" 或者 "replay:<截图目录或视频>"
+        input_backend: "autoit", "sendinput" 或者 "recording[:<jsonl路径>]"
+        timing_output: 每个操作的耗时写入这个 jsonl 文件, 默认写到 logs 目录
+        telemetry_output: 每个操作的截图/匹配耗时和分数, 用 report 命令查看
+        """
+        init_logger()
         init_db()
-        for job_data in data:
-            Job.create(**job_data)
-            for task_data in job_data["tasks"]:
-                Task.create(**task_data)
-                for ope_data in task_data["operations"]:
-                    Operation.create(**ope_data)
-
-        logger.info(f"Database loaded from {path}")
+        jobs = load_job_tree(Job.select().where(Job.name == name).limit(1))
+        if not jobs:
+            logger.error(f"Job not found: {name}")
+            return False
+        plan = compile_job(jobs[0], CWD)
+        db.close()
+
+        if timing_output is None:
+            timing_output = CWD / "logs" / f"timing-{time.strftime('%Y%m%d')}.jsonl"
+        timing_output = Path(timing_output)
+        timing_output.parent.mkdir(parents=True, exist_ok=True)
+
+        executor = JobExecutor(
+            plan,
+            cwd=CWD,
+            capture_backend=make_capture_backend(capture_backend),
+            input_backend=make_input_backend(input_backend),
+            default_max_delay=default_max_delay,
+            telemetry_path=CWD / telemetry_output,
+        )
+        failed = 0
+        for i in range(repeat):
+            logger.info(f"Run {i + 1}/{repeat}: {plan.name}")
+            started_at = time.time()
+            try:
+                executor.run_job()
+            except Exception as e:
+                failed += 1
+                logger.exception(f"Job failed: {e}")
+            with open(timing_output, "a", encoding="utf-8") as f:
+                for timing in executor.scheduler.timings:
+                    record = {
+                        "job": plan.name,
+                        "run": i + 1,
+                        "started_at": started_at,
+                        **timing._asdict(),
+                    }
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        executor.bot.capture_backend.close()
+
+        logger.info(
+            f"{repeat - failed}/{repeat} runs succeeded, timing written to {timing_output}"
+        )
+        return failed == 0
+
+    def report(self, path=TELEMETRY_FILE, job=None):
+        """
+        统计 telemetry, 输出每个操作和每个任务耗时的 p50/p95
+        """
+        if not os.path.exists(path):
+            logger.info(f"No telemetry records in {path}")
+            return
+        operations = {}
+        runs = {}
+        for record in read_records(path):
+            if job and record.get("job") != job:
+                continue
+            key = (record.get("job"), record.get("operation"))
+            operations.setdefault(key, []).append(record)
+            run_key = (record.get("job"), record.get("run_id"))
+            runs[run_key] = runs.get(run_key, 0.0) + record["wall_seconds"]
+
+        if not operations:
+            logger.info(f"No telemetry records in {path}")
+            return
+
+        def pct(values, q):
+            return float(np.percentile(values, q)) if values else float("nan")
+
+        lines = [
+            f"{'job':<16} {'operation':<28} {'n':>5} {'p50':>7} {'p95':>7} "
+            f"{'capture':>8} {'match':>8} {'score':>6} {'retry':>6} {'fail':>5}"
+        ]
+        for (job_name, ope_name), records in sorted(operations.items()):
+            walls = [r["wall_seconds"] for r in records]
+            scores = [r["best_score"] for r in records if r["best_score"] is not None]
+            n = len(records)
+            lines.append(
+                f"{str(job_name)[:16]:<16} {str(ope_name)[:28]:<28} {n:>5} "
+                f"{pct(walls, 50):>7.2f} {pct(walls, 95):>7.2f} "
+                f"{sum(r['capture_seconds'] for r in records) / n:>8.3f} "
+                f"{sum(r['match_seconds'] for r in records) / n:>8.3f} "
+                f"{(sum(scores) / len(scores)) if scores else float('nan'):>6.3f} "
+                f"{sum(r['retries'] for r in records) / n:>6.2f} "
+                f"{sum(1 for r in records if not r.get('ok', True)):>5}"
+            )
+
+        lines.append("")
+        lines.append(f"{'job':<16} {'runs':>5} {'p50':>8} {'p95':>8}")
+        job_runs = {}
+        for (job_name, _), seconds in runs.items():
+            job_runs.setdefault(job_name, []).append(seconds)
+        for job_name, seconds in sorted(job_runs.items()):
+            lines.append(
+                f"{str(job_name)[:16]:<16} {len(seconds):>5} "
+                f"{pct(seconds, 50):>8.2f} {pct(seconds, 95):>8.2f}"
+            )
+        print("\n".join(lines))
+
+    def tunethresholds(
+        self,
+        path=TELEMETRY_FILE,
+        min_samples=20,
+        apply=False,
+        histogram=False,
+        rescue=False,
+    ):
+        """
+        根据 telemetry 里记录的匹配分数, 计算每个模板的推荐阈值
+
+        --histogram 输出每个模板成功/失败分数的直方图
+        --apply 把推荐阈值写入使用这个模板的 operation
+        --rescue 允许推荐值低于之前失败的分数, 让这些匹配也能通过
+        """
+        if not os.path.exists(path):
+            logger.info(f"No telemetry records in {path}")
+            return
+        scores = {}
+        for template, samples in collect_scores(read_records(path)).items():
+            key = CWD.joinpath(template).as_posix()
+            scores.setdefault(key, []).extend(samples)
+        if not scores:
+            logger.info(f"No match scores in {path}")
+            return
+
+        recommendations = {}
+        lines = [
+            f"{'template':<40} {'pass':>6} {'fail':>6} {'current':>8} "
+            f"{'recommend':>9} {'rescued':>8}  reason"
+        ]
+        for template, samples in sorted(scores.items()):
+            rec = recommend_threshold(
+                template, samples, min_samples=min_samples, rescue=rescue
+            )
+            recommendations[template] = rec
+            recommended = "-" if rec.recommended is None else f"{rec.recommended:.3f}"
+            lines.append(
+                f"{Path(template).name[:40]:<40} {rec.passed:>6} {rec.failed:>6} "
+                f"{rec.current:>8.3f} {recommended:>9} {rec.rescued:>8}  {rec.reason}"
+            )
+            if histogram:
+                lines.extend(self._format_histogram(samples))
+        print("\n".join(lines))
+
+        if not apply:
+            return
+
+        init_db()
+        updated = 0
+        with db.atomic():
+            for ope in Operation.select():
+                changed = False
+                # 按操作类型找实际用这个阈值匹配的图像,
+                # click_percent 的 screen_img 只是截图, 运行时不会匹配
+                images = compile_operation(ope, CWD).threshold_images()
+                for field, img_path in images.items():
+                    rec = recommendations.get(img_path)
+                    if rec is None or rec.recommended is None:
+                        continue
+                    if getattr(ope, field) != rec.recommended:
+                        setattr(ope, field, rec.recommended)
+                        changed = True
+                if changed:
+                    ope.save()
+                    updated += 1
+        logger.info(f"Updated thresholds on {updated} operations")
+
+    def _format_histogram(self, samples, bins=20, width=30):
+        passed = [score for score, threshold in samples if score >= threshold]
+        failed = [score for score, threshold in samples if score < threshold]
+        passed_counts, edges = score_histogram(passed, bins)
+        failed_counts, _ = score_histogram(failed, bins)
+        peak = max(passed_counts.max(), failed_counts.max(), 1)
+        lines = []
+        for i in range(bins):
+            if passed_counts[i] == 0 and failed_counts[i] == 0:
+                continue
+            lines.append(
+                f"    {edges[i]:.2f}-{edges[i + 1]:.2f} "
+                f"{'#' * round(passed_counts[i] / peak * width):<{width}} "
+                f"{'.' * round(failed_counts[i] / peak * width):<{width}} "
+                f"{passed_counts[i]:>5} {failed_counts[i]:>5}"
+            )
+        return lines
 
     def sqliteweb(self, path="db.sqlite3"):
         logger.info("Starting SQLiteWeb")
@@ -0,0 +1,101 @@
+import json
+import os
+from typing import NamedTuple
+
+from loguru import logger
+
+from matcher import best_match, match_cost
+from settings import IN_SCREEN_THRESHOLD, SCREEN_THRESHOLD
+
+
+class ScreenSignature(NamedTuple):
+    label: str
+    img_path: str
+    # "is" 为整个页面匹配, "in" 为页面中的一部分, 只影响默认阈值
+    match_type: str = "is"
+    threshold: float = None
+
+    def get_threshold(self):
+        if self.threshold is not None:
+            return self.threshold
+        return IN_SCREEN_THRESHOLD if self.match_type == "in" else SCREEN_THRESHOLD
+
+
+DEFAULT_SCREEN_SIGNATURES = [
+    ScreenSignature("login_notice", "login_notice.png"),
+    ScreenSignature("wait_touch_to_start", "wait_touch_to_start.png"),
+    ScreenSignature("game_main", "game_main.png"),
+    ScreenSignature("game_defense_box", "game_defense_box.png"),
+    ScreenSignature("defense_annihilate_box", "defense_annihilate_box.png"),
+    ScreenSignature("game_notice", "game_notice_header.png", "in"),
+    ScreenSignature("game_ark_page", "game_ark_page.png"),
+    ScreenSignature("mail_box", "mail_box_header.png", "in"),
+    ScreenSignature("tribe_tower", "tribe_tower_header.png", "in"),
+]
+
+
+def load_screen_signatures(path):
+    """
+    从 json 文件读取页面定义, 文件不存在时使用默认定义
+
+    格式: [{"label": ..., "img_path": ..., "match_type": "in", "threshold": 0.9}, ...]
+    """
+    if not path or not os.path.exists(path):
+        return list(DEFAULT_SCREEN_SIGNATURES)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return [ScreenSignature(**item) for item in data]
+
+
+class ScreenClassifier:
+    """
+    只截一次图, 用所有注册的页面定义去匹配, 返回最可信的页面
+
+    计算量小的模板先匹配, 分数超过 certain_score 时直接返回
+    """
+
+    UNKNOWN = "unknown"
+
+    def __init__(self, bot, signatures=None, certain_score=0.97):
+        self.bot = bot
+        self.signatures = list(
+            DEFAULT_SCREEN_SIGNATURES if signatures is None else signatures
+        )
+        self.certain_score = certain_score
+
+    @classmethod
+    def from_file(cls, bot, path, **kwargs):
+        return cls(bot, load_screen_signatures(path), **kwargs)
+
+    def register(self, signature: ScreenSignature):
+        self.signatures.append(signature)
+
+    def _ordered_signatures(self, screen_shape):
+        def cost(signature):
+            template = self.bot.get_gray_img(signature.img_path)
+            return match_cost(screen_shape, template.shape)
+
+        return sorted(self.signatures, key=cost)
+
+    def classify(self):
+        """返回 (label, confidence), 都不匹配时返回 ("unknown", 最高分)"""
+        with self.bot.frame():
+            screen_gray = self.bot.get_game_screen_gray()
+
+        best_label = self.UNKNOWN
+        best_score = 0.0
+        highest_score = 0.0
+        for signature in self._ordered_signatures(screen_gray.shape):
+            template = self.bot.get_gray_img(signature.img_path)
+            score, _ = best_match(screen_gray, template)
+            highest_score = max(highest_score, score)
+            if score < signature.get_threshold() or score <= best_score:
+                continue
+            best_label, best_score = signature.label, score
+            if score >= self.certain_score:
+                break
+
+        if best_label == self.UNKNOWN:
+            logger.debug(f"未识别当前页面, 最高分: {highest_score:.3f}")
+            return best_label, highest_score
+        return best_label, best_score
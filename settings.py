@@ -1,2 +1,12 @@
 MATCH_IMG_DIR = "match_images"
 MATCH_IMG_EXT = "jpg"
+SCREEN_SIGNATURES_FILE = "screens.json"
+TELEMETRY_FILE = "logs/telemetry.jsonl"
+# 默认匹配阈值, operation 上设置了 screen_threshold / click_threshold 时使用设置的值
+SCREEN_THRESHOLD = 0.8
+IN_SCREEN_THRESHOLD = 0.9
+CLICK_THRESHOLD = 0.8
+# 多尺度匹配时模板的缩放范围和步长, 窗口大小或 DPI 和保存模板时不同时使用,
+# 例如 (0.5, 1.5); 为 None 时不做多尺度匹配
+MATCH_SCALE_RANGE = None
+MATCH_SCALE_STEP = 0.05
@@ -11,6 +11,8 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import QThreadPool
 
 from db.models import Job, Task
+from db.loader import load_job
+from db.ordering import reorder
 from .task_card import TaskCard
 from .dnd_widget import DragItemContainer, DragWidget
 from .utils import clear_layout
@@ -93,8 +95,20 @@ class JobCard(QWidget):
         worker.signals.error.connect(
             lambda err: QMessageBox.critical(self, "Error", str(err))
         )
+        worker.signals.preload_progress.connect(self.handle_preload_progress)
+        worker.signals.finished.connect(self.reset_run_btn)
+        worker.signals.error.connect(self.reset_run_btn)
         QThreadPool.globalInstance().start(worker)
 
+    def handle_preload_progress(self, done, total, img_path):
+        if done < total:
+            self.run_btn.setText(f"Loading {done}/{total}")
+        else:
+            self.run_btn.setText("Running")
+
+    def reset_run_btn(self, *args):
+        self.run_btn.setText("Run Job")
+
     def add_task(self):
         name, ok = QInputDialog.getText(self, "Create Task", "Task Name:")
         if ok and name:
@@ -102,13 +116,11 @@ class JobCard(QWidget):
             self.handle_data_changed()
 
     def handle_order_changed(self, order):
-        ids = [item.id for item in order]
-        self.job.task_order = ids
-        self.job.save()
+        reorder(order)
 
     def handle_data_changed(self):
         """按理来说应该是计算哪个加哪个减了, 图方便先直接全部重载"""
-        self.job = Job.get_by_id(self.job.id)
+        self.job = load_job(self.job.id)
         self.rerender_tasks()
 
     def rerender_tasks(self):
@@ -5,6 +5,7 @@ from chiyoui.widget import Button, Label
 from chiyoui.reactive import use_signal
 
 from db.models import Job
+from db.loader import load_job_tree
 from .job_card import JobCard
 from .utils import zoom_rect
 from .multi_input_dialog import MultiInputDialog
@@ -20,7 +21,7 @@ class MainWindow(QMainWindow):
 
         self.job_widgets = use_signal([])
 
-        all_jobs = Job.select()
+        all_jobs = load_job_tree()
         if len(all_jobs) <= 0:
             self.job_widgets.set([Label("No Jobs")])
         for job in all_jobs:
@@ -49,7 +50,7 @@ class MainWindow(QMainWindow):
             self.rerender_jobs()
 
     def rerender_jobs(self):
-        all_jobs = Job.select()
+        all_jobs = load_job_tree()
         self.job_widgets.set([])
         if len(all_jobs) <= 0:
             self.job_widgets.set([Label("No Jobs")])
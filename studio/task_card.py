@@ -12,6 +12,8 @@ from PyQt6.QtCore import pyqtSignal
 
 
 from db.models import Task, Operation, OperationType
+from db.loader import load_task
+from db.ordering import reorder
 from .operation_editor import OperationEditor
 from .screenshot import ScreenshotWidget
 from .utils import clear_layout
@@ -180,7 +182,7 @@ class TaskCardBody(QWidget):
         self.on_operations_order_changed.emit(new_order)
 
     def add_operation(self):
-        self.task = Task.get_by_id(self.task.id)
+        self.task = load_task(self.task.id)
         self.rerender_operations()
 
     def rerender_operations(self):
@@ -267,9 +269,7 @@ class TaskCard(QWidget):
             self.title_label.setFont(font)
 
     def handle_operations_order_changed(self, new_order: list[Operation]):
-        ids = [op.id for op in new_order]
-        self.task.operation_order = ids
-        self.task.save()
+        reorder(new_order)
 
     def delete_task(self):
         confirm = QMessageBox.question(
@@ -312,4 +312,4 @@ class TaskCard(QWidget):
 
     def handle_operation_saved(self, operation: Operation):
         self.body_widget.add_operation()
-        self.task = Task.get_by_id(self.task.id)
+        self.task = load_task(self.task.id)
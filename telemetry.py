@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+_file_lock = threading.Lock()
+
+
+class Telemetry:
+    """
+    记录每个操作的截图耗时, 匹配耗时, 最高分, 位置, 重试次数和总耗时
+
+    begin/end 之间 bot 调用 add_* 累计数据, end 时把一条记录追加到 jsonl 文件,
+    path 为 None 时只保存在 records 里
+
+    scores 里记录每次匹配的 [模板路径, 分数, 阈值], 用于调整每个模板的阈值
+    """
+
+    def __init__(self, path=None, keep_records=False):
+        self.path = Path(path) if path else None
+        self.keep_records = keep_records
+        self.records = []
+        self._current = None
+        self._started_at = None
+
+    def begin(self, **fields):
+        self._started_at = time.perf_counter()
+        self._current = {
+            "ts": time.time(),
+            **fields,
+            "captures": 0,
+            "capture_seconds": 0.0,
+            "matches": 0,
+            "match_seconds": 0.0,
+            "best_score": None,
+            "best_loc": None,
+            "scores": [],
+            "retries": 0,
+            # 等待页面时画面没有变化, 跳过的匹配次数
+            "skipped_matches": 0,
+        }
+
+    def add_capture(self, seconds):
+        if self._current is None:
+            return
+        self._current["captures"] += 1
+        self._current["capture_seconds"] += seconds
+
+    def add_match(self, seconds, score, loc=None, template=None, threshold=None):
+        if self._current is None:
+            return
+        self._current["matches"] += 1
+        self._current["match_seconds"] += seconds
+        if template is not None:
+            self._current["scores"].append(
+                [str(template), round(float(score), 4), threshold]
+            )
+        best_score = self._current["best_score"]
+        if best_score is None or score > best_score:
+            self._current["best_score"] = float(score)
+            self._current["best_loc"] = list(loc) if loc is not None else None
+
+    def add_retry(self):
+        if self._current is None:
+            return
+        self._current["retries"] += 1
+
+    def add_skipped_match(self):
+        if self._current is None:
+            return
+        self._current["skipped_matches"] += 1
+
+    def end(self, **fields):
+        if self._current is None:
+            return None
+        record = self._current
+        record["wall_seconds"] = time.perf_counter() - self._started_at
+        record.update(fields)
+        self._current = None
+        if self.keep_records:
+            self.records.append(record)
+        if self.path:
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+            with _file_lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        return record
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
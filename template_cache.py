@@ -0,0 +1,169 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from matcher import scale_template
+
+
+def decode_image(path):
+    """读取图像, 返回只读的 (bgr, gray)"""
+    # 因为cv2不支持中文路径, 所以这里不用cv2.imread
+    pil_img = Image.open(path).convert("RGB")
+    bgr = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    bgr.setflags(write=False)
+    gray.setflags(write=False)
+    return bgr, gray
+
+
+class TemplateCache:
+    """
+    模板图像缓存, key 为 (路径, mtime), 同时保存 BGR 和灰度图
+
+    超过 max_bytes 时按 LRU 淘汰
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> (mtime, bgr, gray)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, fullpath):
+        """返回 (bgr, gray), 两个数组都是只读的"""
+        key = os.fspath(fullpath)
+        mtime = os.stat(key).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+
+        bgr, gray = decode_image(key)
+        with self._lock:
+            self._put(key, (mtime, bgr, gray))
+        return bgr, gray
+
+    def _put(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old:
+            self._size -= old[1].nbytes + old[2].nbytes
+        self._entries[key] = entry
+        self._size += entry[1].nbytes + entry[2].nbytes
+        # 至少保留刚放进去的这一个
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted[1].nbytes + evicted[2].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class ScaledTemplateCache:
+    """
+    记录每个窗口大小 (截图的 h, w) 匹配成功的缩放比例, 以及缩放后的模板
+
+    模板是按截图时的分辨率保存的, 窗口大小或 DPI 变了以后要缩放模板才能匹配上,
+    比例确定以后同一个窗口大小只用这一个比例匹配
+
+    - 1.0 匹配成功时直接确定为 1.0
+    - 其他比例要在 lock_wins 次 1.0 没匹配上的匹配中胜出,
+      并且至少来自 lock_templates 个不同的模板, 避免被一个长得像的图骗到
+    - 确定的比例连续 unlock_failures 次匹配失败后忘掉, 重新查找
+    """
+
+    def __init__(self, scales, lock_wins=3, lock_templates=2, unlock_failures=20):
+        self.scales = list(scales)
+        self.lock_wins = lock_wins
+        self.lock_templates = lock_templates
+        self.unlock_failures = unlock_failures
+        self._window_scales = {}  # (h, w) -> scale
+        self._wins = {}  # (h, w) -> {scale: [胜出次数, {模板, ...}]}
+        self._failures = {}  # (h, w) -> 确定的比例连续失败的次数
+        # (id(原模板), scale) -> (原模板, 缩放后的模板), 保存原模板保证 id 不会被复用
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get_scale(self, window_size):
+        """还没确定时返回 None"""
+        return self._window_scales.get(tuple(window_size))
+
+    def report(self, window_size, scale, success, template_key):
+        """
+        记录一次匹配的结果, scale 为分数最高的比例, template_key 用来区分不同的模板
+
+        返回 (变化前的比例, 变化后的比例)
+        """
+        window_size = tuple(window_size)
+        with self._lock:
+            old_scale = self._window_scales.get(window_size)
+            if old_scale is not None:
+                if success:
+                    self._failures.pop(window_size, None)
+                else:
+                    failures = self._failures.get(window_size, 0) + 1
+                    self._failures[window_size] = failures
+                    if failures >= self.unlock_failures:
+                        self._forget(window_size)
+            elif success:
+                win = self._wins.setdefault(window_size, {}).setdefault(
+                    scale, [0, set()]
+                )
+                win[0] += 1
+                win[1].add(template_key)
+                if scale == 1.0 or (
+                    win[0] >= self.lock_wins and len(win[1]) >= self.lock_templates
+                ):
+                    self._window_scales[window_size] = scale
+                    self._wins.pop(window_size, None)
+            return old_scale, self._window_scales.get(window_size)
+
+    def _forget(self, window_size):
+        self._window_scales.pop(window_size, None)
+        self._wins.pop(window_size, None)
+        self._failures.pop(window_size, None)
+
+    def candidates(self, window_size):
+        scale = self.get_scale(window_size)
+        if scale is not None:
+            return [scale]
+        return self.scales
+
+    def get(self, template_gray, scale):
+        """返回缩放后的模板, 同一个模板数组每个比例只缩放一次"""
+        if scale == 1.0:
+            return template_gray
+        cache_key = (id(template_gray), scale)
+        with self._lock:
+            entry = self._templates.get(cache_key)
+        if entry:
+            return entry[1]
+        scaled = scale_template(template_gray, scale)
+        with self._lock:
+            self._templates[cache_key] = (template_gray, scaled)
+        return scaled
+
+    def clear_templates(self):
+        """窗口大小变化后旧比例的模板用不到了"""
+        with self._lock:
+            self._templates.clear()
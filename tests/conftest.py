@@ -0,0 +1,74 @@
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from capture import CaptureBackend  # noqa: E402
+from input_backend import RecordingInputBackend  # noqa: E402
+
+
+class FakeCaptureBackend(CaptureBackend):
+    """按时间返回画面的截图后端, frame_fn(秒数) 返回灰度图"""
+
+    def __init__(self, frame_fn):
+        self.frame_fn = frame_fn
+        self.start = None
+        self.grab_count = 0
+
+    def elapsed(self):
+        if self.start is None:
+            self.start = time.perf_counter()
+        return time.perf_counter() - self.start
+
+    def find_window(self, window_name):
+        return 1
+
+    def get_window_rect(self, hwnd):
+        h, w = self.frame_fn(0).shape[:2]
+        return (0, 0, w, h)
+
+    def set_foreground(self, hwnd):
+        pass
+
+    def grab(self, rect):
+        return cv2.cvtColor(self.grab_gray(rect), cv2.COLOR_GRAY2BGRA)
+
+    def grab_gray(self, rect):
+        self.grab_count += 1
+        return self.frame_fn(self.elapsed())
+
+
+def make_button(w=240, h=120, seed=0):
+    rng = np.random.default_rng(seed)
+    button = rng.integers(60, 200, (h // 8, w // 8), dtype=np.uint8)
+    return cv2.resize(button, (w, h), interpolation=cv2.INTER_NEAREST)
+
+
+def make_background(w=1920, h=1080):
+    background = np.full((h, w), 40, dtype=np.uint8)
+    background[:, ::7] = 48
+    return background
+
+
+@pytest.fixture
+def make_bot(tmp_path):
+    from bot import NikkeBot
+
+    def factory(frame_fn, templates, **kwargs):
+        for name, image in templates.items():
+            cv2.imwrite(str(tmp_path / name), image)
+        kwargs.setdefault("retry_interval", 0.1)
+        return NikkeBot(
+            cwd=str(tmp_path),
+            window_name="fake",
+            capture_backend=FakeCaptureBackend(frame_fn),
+            input_backend=RecordingInputBackend(),
+            **kwargs,
+        )
+
+    return factory
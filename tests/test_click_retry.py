@@ -0,0 +1,30 @@
+from conftest import make_background, make_button
+
+
+def make_frames(appear_at):
+    background = make_background()
+    button = make_button()
+    screen = background.copy()
+    screen[600:720, 1200:1440] = button
+    return (lambda t: screen if t >= appear_at else background), button
+
+
+def test_click_img_retry_clicks_button_appearing_after_first_failure(make_bot):
+    frame_fn, button = make_frames(0.1)
+    bot = make_bot(frame_fn, {"btn.png": button})
+    bot.telemetry.begin(job="btn")
+    assert bot.click_img_with_retry("btn.png", screen="btn.png", job_name="btn")
+    record = bot.telemetry.end()
+    assert bot.input_backend.clicks() == [(1320, 660)]
+    assert record["retries"] >= 1
+
+
+def test_click_img_retry_watches_outside_roi(make_bot):
+    # 按钮在 roi 外, 靠整个页面的匹配找到
+    frame_fn, button = make_frames(0.1)
+    bot = make_bot(frame_fn, {"btn.png": button})
+    roi = (0.0, 0.0, 0.2, 0.2)
+    assert bot.click_img_with_retry(
+        "btn.png", screen="btn.png", screen_roi=roi, click_roi=roi
+    )
+    assert bot.input_backend.clicks() == [(1320, 660)]
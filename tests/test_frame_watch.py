@@ -0,0 +1,56 @@
+import numpy as np
+
+from conftest import make_background, make_button
+from frame_watch import FrameChangeDetector
+
+
+def test_detector_sees_small_button():
+    background = make_background()
+    screen = background.copy()
+    screen[600:720, 1200:1440] = make_button()
+    detector = FrameChangeDetector()
+    assert detector.changed(background)
+    assert not detector.changed(background.copy())
+    assert detector.changed(screen)
+
+
+def test_detector_ignores_noise():
+    background = make_background()
+    rng = np.random.default_rng(1)
+    noisy = np.clip(background + rng.integers(-3, 4, background.shape), 0, 255).astype(
+        np.uint8
+    )
+    detector = FrameChangeDetector()
+    detector.changed(background)
+    assert not detector.changed(noisy)
+
+
+def test_wait_until_timeout_finds_small_button(make_bot):
+    background = make_background()
+    button = make_button()
+    screen = background.copy()
+    screen[600:720, 1200:1440] = button
+
+    bot = make_bot(lambda t: screen if t >= 0.3 else background, {"btn.png": button})
+    elapsed = bot.wait_until_timeout("btn.png", 3)
+    assert 0.3 <= elapsed < 1.5
+
+
+def test_wait_for_screen_forces_match_when_change_is_missed(make_bot, monkeypatch):
+    background = make_background()
+    button = make_button()
+    screen = background.copy()
+    screen[600:720, 1200:1440] = button
+
+    bot = make_bot(lambda t: screen if t >= 0.3 else background, {"btn.png": button})
+    # 变化检测完全失灵时也要定期真的匹配一次
+    changed = FrameChangeDetector.changed
+    calls = []
+
+    def changed_once(self, screen_gray):
+        calls.append(1)
+        return len(calls) == 1 and changed(self, screen_gray)
+
+    monkeypatch.setattr(FrameChangeDetector, "changed", changed_once)
+    elapsed = bot.wait_for_screen("btn.png", 3, force_match_interval=0.5)
+    assert elapsed is not None and elapsed < 1.5
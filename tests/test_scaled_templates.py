@@ -0,0 +1,48 @@
+from matcher import scale_candidates
+from template_cache import ScaledTemplateCache
+
+SIZE = (1080, 1920)
+
+
+def make_cache(**kwargs):
+    return ScaledTemplateCache(scale_candidates((0.5, 1.5), 0.1), **kwargs)
+
+
+def test_one_is_locked_on_first_success():
+    cache = make_cache()
+    assert cache.report(SIZE, 1.0, True, "a.png") == (None, 1.0)
+    assert cache.candidates(SIZE) == [1.0]
+
+
+def test_look_alike_does_not_lock_scale():
+    cache = make_cache()
+    for _ in range(5):
+        cache.report(SIZE, 0.6, True, "a.png")
+    assert cache.get_scale(SIZE) is None
+    assert cache.candidates(SIZE)[0] == 1.0
+
+
+def test_scale_locked_after_wins_from_several_templates():
+    cache = make_cache(lock_wins=3, lock_templates=2)
+    cache.report(SIZE, 0.8, True, "a.png")
+    cache.report(SIZE, 0.8, True, "a.png")
+    assert cache.get_scale(SIZE) is None
+    assert cache.report(SIZE, 0.8, True, "b.png") == (None, 0.8)
+    assert cache.candidates(SIZE) == [0.8]
+
+
+def test_scale_unlocked_after_repeated_failures():
+    cache = make_cache(unlock_failures=3)
+    cache.report(SIZE, 1.0, True, "a.png")
+    cache.report(SIZE, 1.0, False, "a.png")
+    cache.report(SIZE, 1.0, True, "a.png")
+    cache.report(SIZE, 1.0, False, "a.png")
+    cache.report(SIZE, 1.0, False, "a.png")
+    assert cache.get_scale(SIZE) == 1.0
+    assert cache.report(SIZE, 1.0, False, "a.png") == (1.0, None)
+    assert len(cache.candidates(SIZE)) > 1
+
+
+def test_multiscale_is_opt_in(make_bot):
+    bot = make_bot(lambda t: None, {})
+    assert bot.scaled_templates.scales == [1.0]
@@ -0,0 +1,54 @@
+from conftest import make_background
+from db.models import OperationType
+from engine.plan import OperationPlan
+from engine.scheduler import OperationScheduler
+
+
+def make_operation(operation_type=OperationType.CLICK_PERCENT, **kwargs):
+    fields = dict(
+        id=1,
+        name="op",
+        operation_type=operation_type,
+        ignore_error=False,
+        screen_img=None,
+        click_img=None,
+        click_percent_x=0.5,
+        click_percent_y=0.5,
+        click_percent_match_img=None,
+        click_times=1,
+        wait_timeout=None,
+        is_implicity_wait=False,
+        screen_roi=None,
+        click_roi=None,
+        pyramid_level=0,
+        min_delay=None,
+        max_delay=None,
+        screen_threshold=None,
+        click_threshold=None,
+    )
+    fields.update(kwargs)
+    return OperationPlan(**fields)
+
+
+def animated_frame(t):
+    # 待机动画: 120x120 的角色以 60 像素/秒来回移动
+    frame = make_background()
+    x = 600 + int(60 * t) % 240
+    frame[480:600, x : x + 120] = 220
+    return frame
+
+
+def test_settle_wait_is_capped_with_idle_animation(make_bot):
+    bot = make_bot(animated_frame, {})
+    scheduler = OperationScheduler(bot, default_max_delay=5.0)
+    waited, detected = scheduler.wait_before(make_operation())
+    assert detected is None
+    assert waited < 1.3
+
+
+def test_settle_wait_ends_when_frame_is_still(make_bot):
+    background = make_background()
+    bot = make_bot(lambda t: background, {})
+    scheduler = OperationScheduler(bot, default_max_delay=5.0)
+    waited, _ = scheduler.wait_before(make_operation())
+    assert 0.3 <= waited < 0.8
@@ -0,0 +1,39 @@
+import numpy as np
+
+from threshold_tuning import recommend_threshold
+
+
+def make_samples(rng, low, high, count, threshold=0.9):
+    return [(float(score), threshold) for score in rng.uniform(low, high, count)]
+
+
+def test_near_misses_are_not_rescued():
+    rng = np.random.default_rng(0)
+    samples = (
+        make_samples(rng, 0.93, 0.99, 40)
+        + make_samples(rng, 0.82, 0.88, 15)
+        + make_samples(rng, 0.2, 0.5, 40)
+    )
+    rec = recommend_threshold("btn.png", samples)
+    assert rec.rescued == 0
+    assert rec.recommended > max(score for score, _ in samples if score < 0.9)
+
+
+def test_recommendation_anchored_to_passing_scores():
+    rng = np.random.default_rng(1)
+    samples = make_samples(rng, 0.95, 0.99, 40) + make_samples(rng, 0.2, 0.5, 40)
+    rec = recommend_threshold("btn.png", samples, margin=0.05)
+    lowest_passed = min(score for score, _ in samples if score >= 0.9)
+    assert rec.recommended == round(lowest_passed - 0.05, 3)
+
+
+def test_rescue_needs_flag():
+    rng = np.random.default_rng(2)
+    samples = (
+        make_samples(rng, 0.92, 0.99, 40)
+        + make_samples(rng, 0.85, 0.88, 10)
+        + make_samples(rng, 0.2, 0.5, 40)
+    )
+    assert recommend_threshold("btn.png", samples, margin=0.1).rescued == 0
+    rec = recommend_threshold("btn.png", samples, margin=0.1, rescue=True)
+    assert rec.rescued == 10
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from db.models import Job, Operation, OperationType, Task, db, init_db
+
+
+@pytest.fixture
+def tmp_db(tmp_path):
+    db.init(str(tmp_path / "db.sqlite3"))
+    init_db()
+    yield
+    db.close()
+
+
+def write_scores(path, template, scores, threshold=0.8):
+    record = {"scores": [[template, score, threshold] for score in scores]}
+    path.write_text(json.dumps(record) + "\n", encoding="utf-8")
+
+
+def test_apply_uses_click_percent_match_img(tmp_path, tmp_db):
+    from mng import Mng
+
+    match_img = (tmp_path / "match.png").as_posix()
+    screen_img = (tmp_path / "op-screen.jpg").as_posix()
+    job = Job.create(name="job", window_name="win")
+    task = Task.create(name="task", job=job)
+    ope = Operation.create(
+        name="op",
+        operation_type=OperationType.CLICK_PERCENT.value,
+        screen_img=screen_img,
+        click_percent_x=0.5,
+        click_percent_y=0.5,
+        click_percent_match_img=match_img,
+        task=task,
+    )
+    telemetry = tmp_path / "telemetry.jsonl"
+    write_scores(telemetry, match_img, [0.97] * 20 + [0.3] * 20)
+
+    Mng().tunethresholds(path=str(telemetry), apply=True)
+
+    assert Operation.get_by_id(ope.id).screen_threshold == pytest.approx(0.92)
@@ -0,0 +1,94 @@
+import math
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+class ThresholdRecommendation(NamedTuple):
+    template: str
+    passed: int
+    failed: int
+    # 记录里最常用的阈值
+    current: Optional[float]
+    recommended: Optional[float]
+    # 用推荐阈值时, 原来没通过但会通过的匹配次数, 只有 rescue 时才会大于 0
+    rescued: int
+    reason: str
+
+
+def collect_scores(records):
+    """从 telemetry 记录中收集每个模板的 [(分数, 阈值), ...]"""
+    scores = {}
+    for record in records:
+        for template, score, threshold in record.get("scores", []):
+            if threshold is None:
+                continue
+            scores.setdefault(template, []).append((score, threshold))
+    return scores
+
+
+def score_histogram(scores, bins=20):
+    """返回 (counts, edges), 分数限制在 0~1 之间"""
+    values = np.clip(np.asarray(scores, dtype="float64"), 0.0, 1.0)
+    return np.histogram(values, bins=bins, range=(0.0, 1.0))
+
+
+def _round_up(value, digits=3):
+    """向上取到 digits 位小数, 结果一定大于 value"""
+    step = 10**-digits
+    return round(math.floor(value / step + 1e-9) * step + step, digits)
+
+
+def recommend_threshold(
+    template,
+    samples,
+    min_samples=20,
+    margin=0.05,
+    lower=0.6,
+    upper=0.97,
+    rescue=False,
+    rescue_floor=0.6,
+):
+    """
+    根据 [(分数, 阈值), ...] 计算推荐阈值
+
+    以成功的分数为准, 推荐成功分数中最低的减去 margin;
+    rescue 为 False 时推荐值一定高于失败记录中不低于 rescue_floor 的分数,
+    不会让之前被正确拒绝的近似图通过
+    """
+    thresholds = [threshold for _, threshold in samples]
+    current = max(set(thresholds), key=thresholds.count) if thresholds else None
+    passed = [score for score, threshold in samples if score >= threshold]
+    failed = [score for score, threshold in samples if score < threshold]
+
+    def result(recommended, reason):
+        rescued = 0
+        if recommended is not None:
+            rescued = sum(1 for score in failed if score >= recommended)
+        return ThresholdRecommendation(
+            template=template,
+            passed=len(passed),
+            failed=len(failed),
+            current=current,
+            recommended=recommended,
+            rescued=rescued,
+            reason=reason,
+        )
+
+    if len(samples) < min_samples:
+        return result(None, f"样本不足 ({len(samples)} < {min_samples})")
+    if not failed:
+        return result(None, "没有失败的记录")
+    if not passed:
+        return result(None, "从来没有匹配成功, 请检查模板")
+
+    lowest_passed = min(passed)
+    recommended = round(min(max(lowest_passed - margin, lower), upper), 3)
+    reason = f"成功分数最低 {lowest_passed:.3f} - {margin}"
+    rejected = [score for score in failed if score >= rescue_floor]
+    if not rescue and rejected and max(rejected) >= recommended:
+        recommended = _round_up(max(rejected))
+        if recommended > min(lowest_passed, upper):
+            return result(None, "成功和失败的分数太接近")
+        reason = f"高于失败分数 {max(rejected):.3f}"
+    return result(recommended, reason)
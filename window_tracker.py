@@ -0,0 +1,96 @@
+import time
+
+from loguru import logger
+
+
+class WindowTracker:
+    """
+    缓存窗口句柄和位置
+
+    - 位置缓存 rect_max_age_ms 毫秒, 过期后才重新 GetWindowRect
+    - 刷新位置前用 is_window 检查句柄是否还有效, 游戏重启后按标题重新查找
+    - 连续 max_match_failures 次匹配失败时也重新查找一次窗口
+    - 位置变化时通知订阅者 callback(old_rect, new_rect), old_rect 第一次为 None
+    """
+
+    def __init__(
+        self, backend, window_name, rect_max_age_ms=250, max_match_failures=20
+    ):
+        self.backend = backend
+        self.window_name = window_name
+        self.rect_max_age_ms = rect_max_age_ms
+        self.max_match_failures = max_match_failures
+        self._hwnd = None
+        self._rect = None
+        self._rect_at = None
+        self._match_failures = 0
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def invalidate(self):
+        """丢弃缓存的句柄和位置, 下次使用时按标题重新查找"""
+        self._hwnd = None
+        self._rect_at = None
+        self._match_failures = 0
+
+    def get_hwnd(self):
+        """找不到窗口时返回 None"""
+        if self._hwnd is None:
+            self._hwnd = self.backend.find_window(self.window_name)
+            if self._hwnd:
+                logger.debug(f"找到窗口: {self.window_name} ({self._hwnd})")
+        return self._hwnd
+
+    def get_rect(self):
+        """返回 (left, top, right, bottom), 找不到窗口时返回 None"""
+        if self._rect_at is not None:
+            age_ms = (time.perf_counter() - self._rect_at) * 1000
+            if age_ms <= self.rect_max_age_ms:
+                return self._rect
+
+        rect = self._read_rect()
+        if rect is None:
+            # 句柄失效了, 可能是游戏重启, 按标题再找一次
+            self.invalidate()
+            rect = self._read_rect()
+            if rect is None:
+                return None
+        self._update_rect(tuple(rect))
+        return self._rect
+
+    def _read_rect(self):
+        hwnd = self.get_hwnd()
+        if not hwnd or not self.backend.is_window(hwnd):
+            return None
+        try:
+            return self.backend.get_window_rect(hwnd)
+        except Exception as e:
+            logger.debug(f"获取窗口位置失败: {self.window_name} {e}")
+            return None
+
+    def _update_rect(self, rect):
+        old_rect = self._rect
+        self._rect = rect
+        self._rect_at = time.perf_counter()
+        if rect != old_rect:
+            if old_rect is not None:
+                logger.debug(f"窗口位置变化: {old_rect} -> {rect}")
+            for callback in list(self._subscribers):
+                callback(old_rect, rect)
+
+    def report_match(self, success):
+        """匹配结果, 连续失败太多次时可能窗口已经换了, 重新查找"""
+        if success:
+            self._match_failures = 0
+            return
+        self._match_failures += 1
+        if self._match_failures >= self.max_match_failures:
+            logger.debug(
+                f"连续 {self._match_failures} 次匹配失败, 重新查找窗口: {self.window_name}"
+            )
+            self.invalidate()